@@ -0,0 +1,411 @@
+#!/usr/bin/python
+
+from __future__ import with_statement
+
+import codecs
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cssparser
+import scsscompiler
+import scssimporter
+
+try:
+    import resource
+except ImportError:
+    resource = None # peak memory is not reported on platforms without it
+
+
+# differences in timings smaller than this (in ms) are never reported as
+# regressions, as they are within the noise of the measurement
+NOISE_FLOOR = 1.0
+
+# likewise for differences in peak memory usage (in kB)
+MEMORY_NOISE_FLOOR = 256
+
+PHASES = ["parse", "compile", "serialize"]
+
+
+# generates a stylesheet with the given number of rule sets, each with a couple
+# of declarations with long-ish values
+def generateStyleSheet(numRuleSets):
+    lines = []
+    for i in range(0, numRuleSets):
+        lines.append(".rule-%d, .rule-%d > a:hover {" % (i, i))
+        lines.append("  margin: 0 auto %dpx;" % i)
+        lines.append("  font: normal 12px/1.5 \"Helvetica Neue\", Arial, sans-serif;")
+        lines.append("  background: url(images/background-%d.png) no-repeat 0 0;" % i)
+        lines.append("}")
+    return "\n".join(lines)
+
+# generates a stylesheet with a single rule set containing the given number of
+# declarations, mixed with mixin includes and nested properties
+def generateLargeRuleSet(numDeclarations):
+    lines = ["@mixin border($width) { border: $width solid #000; }", ".large {"]
+    for i in range(0, numDeclarations / 4):
+        lines.append("  margin: %dpx auto;" % i)
+        lines.append("  padding: (%dpx + 1px) * 2;" % i)
+        lines.append("  @include border(%dpx);" % i)
+        lines.append("  font: { size: %dpx; }" % i)
+    lines.append("}")
+    return "\n".join(lines)
+
+# generates a stylesheet with rule sets nested to the given depth
+def generateNestedStyleSheet(depth):
+    lines = []
+    for i in range(0, depth):
+        lines.append("  " * i + ".level-%d > a:hover {" % i)
+        lines.append("  " * i + "  padding: %dpx;" % i)
+    for i in reversed(range(0, depth)):
+        lines.append("  " * i + "}")
+    return "\n".join(lines)
+
+# generates a stylesheet with rule sets nested to the given depth, which look up
+# variables, functions and mixins defined at the top on every level
+def generateDeepLookups(depth):
+    lines = ["$gutter: 10px;",
+             "$color: #369;",
+             "@function half($value) { @return $value / 2; }",
+             "@mixin frame($width) { border: $width solid $color; }"]
+    for i in range(0, depth):
+        lines.append("  " * i + ".level-%d {" % i)
+        lines.append("  " * i + "  margin: half($gutter) $gutter * %d;" % i)
+        lines.append("  " * i + "  color: $color;")
+        lines.append("  " * i + "  @include frame(%dpx);" % i)
+    for i in reversed(range(0, depth)):
+        lines.append("  " * i + "}")
+    return "\n".join(lines)
+
+# generates a stylesheet defining the given number of variables, functions and
+# mixins, followed by rule sets using them
+def generateLargeGlobalScope(numDefinitions):
+    lines = []
+    for i in range(0, numDefinitions):
+        lines.append("$size-%d: %dpx;" % (i, i))
+        lines.append("@function scale-%d($value) { @return $value * %d; }" % (i, i))
+        lines.append("@mixin size-%d { width: $size-%d; }" % (i, i))
+    for i in range(0, numDefinitions, 10):
+        lines.append(".use-%d { height: scale-%d($size-%d); @include size-%d; }" % (i, i, i, i))
+    return "\n".join(lines)
+
+# generates a stylesheet with the given number of mixin includes
+def generateMixinCalls(numCalls):
+    lines = ["@mixin box($width, $color: #333) {",
+             "  width: $width;",
+             "  border: 1px solid darken($color, 10%);",
+             "  padding: $width / 10;",
+             "}"]
+    for i in range(0, numCalls):
+        lines.append(".box-%d { @include box(%dpx); }" % (i, i + 10))
+    return "\n".join(lines)
+
+# generates a stylesheet with the given number of rule sets, each of which
+# extends one of the others
+def generateExtends(numExtends):
+    lines = []
+    for i in range(0, numExtends):
+        lines.append(".base-%d, .alias-%d { color: red; }" % (i, i))
+    for i in range(0, numExtends):
+        lines.append(".extend-%d { @extend .base-%d; width: %dpx; }" % (i, (i * 7) % numExtends, i))
+    return "\n".join(lines)
+
+# generates a stylesheet with a loop of the given number of iterations, each of
+# which outputs a rule set
+def generateLoop(numIterations):
+    lines = ["$step: 2px;",
+             "@for $i from 1 through %d {" % numIterations,
+             "  .item-#{$i} { width: $i * $step; margin: $i + 1px; }",
+             "}"]
+    return "\n".join(lines)
+
+# generates the given number of partials in a directory, together with a
+# stylesheet importing all of them
+def generateImportFanOut(directory, numImports):
+    lines = []
+    for i in range(0, numImports):
+        with open(os.path.join(directory, "_partial%d.scss" % i), "w") as f:
+            f.write("$size-%d: %dpx;\n" % (i, i))
+            f.write("@mixin partial-%d { margin: $size-%d; }\n" % (i, i))
+            f.write(".partial-%d { padding: $size-%d * 2; }\n" % (i, i))
+        lines.append("@import \"partial%d\";" % i)
+        lines.append(".use-%d { @include partial-%d; }" % (i, i))
+    return "\n".join(lines)
+
+# returns the list of cases to benchmark, as tuples of a name, the SCSS input
+# and the path from which imports are resolved. if a name is given, only the
+# case with that name is built
+def loadCases(o, directory, name = None):
+    cases = []
+    for test in sorted(os.listdir("test/sass")):
+        path = "test/sass/" + test
+        if test[0] == "." or not os.path.isdir(path):
+            continue
+        if name and name != "test/" + test:
+            continue
+        with codecs.open(path + "/in.scss", "r", "utf-8") as f:
+            cases.append(("test/" + test, f.read(), path))
+
+    generators = [
+        ("nesting-%d" % (25 * o.scale), lambda: generateNestedStyleSheet(25 * o.scale)),
+        ("deep-lookups-%d" % (20 * o.scale), lambda: generateDeepLookups(20 * o.scale)),
+        ("globals-%d" % (1000 * o.scale), lambda: generateLargeGlobalScope(1000 * o.scale)),
+        ("rule-sets-%d" % (500 * o.scale), lambda: generateStyleSheet(500 * o.scale)),
+        ("mixin-calls-%d" % (200 * o.scale), lambda: generateMixinCalls(200 * o.scale)),
+        ("extends-%d" % (200 * o.scale), lambda: generateExtends(200 * o.scale)),
+        ("loops-%d" % (500 * o.scale), lambda: generateLoop(500 * o.scale)),
+        ("imports-%d" % (20 * o.scale), lambda: generateImportFanOut(directory, 20 * o.scale))
+    ]
+    for (caseName, generate) in generators:
+        if name == None or name == caseName:
+            cases.append((caseName, generate(), directory))
+    return cases
+
+# parses, compiles and serializes a stylesheet, returns the time spent in
+# each of the phases
+def runPhases(css, path):
+    options = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True)
+    scssimporter.Importer.reset()
+
+    start = time.time()
+    styleSheet = cssparser.CSSParser().parse(css, options)
+    styleSheet.setPath(path)
+    parsed = time.time()
+    scsscompiler.SCSSCompiler().compile(styleSheet, options)
+    compiled = time.time()
+    styleSheet.toString(options)
+    serialized = time.time()
+    return (parsed - start, compiled - parsed, serialized - compiled)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+# returns how much the peak memory usage (in kB) of a fresh process grows by
+# running a single case, or None if this cannot be measured
+def measurePeakMemory(o, name):
+    if not resource:
+        return None
+
+    command = [sys.executable, os.path.abspath(__file__), "--scale", str(o.scale), "--peak-memory", name]
+    try:
+        return int(subprocess.check_output(command).strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+def timeIt(function, repeat):
+    best = None
+    for i in range(0, repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+# reports whether the time per unit of work stays (roughly) constant when the
+# size of the input grows, returns False if it does not
+def checkLinear(name, sizes, times, tolerance):
+    print "%-12s %10s %12s %14s" % (name, "size", "time (ms)", "per unit (us)")
+    for (size, elapsed) in zip(sizes, times):
+        print "%-12s %10d %12.2f %14.3f" % ("", size, elapsed * 1000, elapsed * 1000000 / size)
+
+    smallest = times[0] / sizes[0]
+    largest = times[-1] / sizes[-1]
+    if largest > smallest * tolerance:
+        print "%s does NOT scale linearly (%.1fx slower per unit)" % (name, largest / smallest)
+        return False
+    return True
+
+def benchSerialize(o):
+    sizes = [o.size / 8, o.size / 4, o.size / 2, o.size]
+    times = []
+    options = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True)
+    for size in sizes:
+        styleSheet = cssparser.CSSParser().parse(generateStyleSheet(size), options)
+        times.append(timeIt(lambda: styleSheet.toString(options), o.repeat))
+    return checkLinear("serialize", sizes, times, o.tolerance)
+
+def benchLargeRuleSet(o):
+    sizes = [o.size / 8, o.size / 4, o.size / 2, o.size]
+    times = []
+    options = cssparser.CSSOptions(compileScss = True)
+    for size in sizes:
+        css = generateLargeRuleSet(size)
+        def compile():
+            styleSheet = cssparser.CSSParser().parse(css, options)
+            scsscompiler.SCSSCompiler().compile(styleSheet, options)
+        times.append(timeIt(compile, o.repeat))
+    return checkLinear("large-block", sizes, times, o.tolerance)
+
+# returns the number of tokens in the tree and the number of bytes they occupy
+def measureTokens(token):
+    numTokens = 1
+    numBytes = sys.getsizeof(token) + sys.getsizeof(token.children)
+    if hasattr(token, "__dict__"):
+        numBytes += sys.getsizeof(token.__dict__)
+    for child in token.children:
+        (childTokens, childBytes) = measureTokens(child)
+        numTokens += childTokens
+        numBytes += childBytes
+    return (numTokens, numBytes)
+
+def benchMemory(o):
+    options = cssparser.CSSOptions(compileScss = True)
+    numTokens = 0
+    numBytes = 0
+    for (directory, directoryNames, fileNames) in os.walk("stylesheets"):
+        for fileName in fileNames:
+            if not fileName.endswith(".scss"):
+                continue
+            with codecs.open(os.path.join(directory, fileName), "r") as f:
+                css = f.read()
+            try:
+                styleSheet = cssparser.CSSParser().parse(css, options)
+            except cssparser.CSSParseError:
+                continue
+            (fileTokens, fileBytes) = measureTokens(styleSheet)
+            numTokens += fileTokens
+            numBytes += fileBytes
+
+    print "%-12s %10s %12s %14s" % ("memory", "tokens", "total (kB)", "per token (B)")
+    print "%-12s %10d %12.1f %14.1f" % ("", numTokens, numBytes / 1024.0, float(numBytes) / numTokens)
+    return True
+
+# compares the results of the phases benchmark against a baseline, returns
+# False if any of the cases regressed
+def compareWithBaseline(results, baseline, threshold):
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for phase in PHASES:
+            current = result[phase]["median"]
+            previous = baseline[name][phase]["median"]
+            if current > previous * threshold and current - previous > NOISE_FLOOR:
+                regressions.append("%s %s: %.2f ms -> %.2f ms" % (name, phase, previous, current))
+        current = result["peakMemory"]
+        previous = baseline[name].get("peakMemory")
+        if (current != None and previous != None and current > previous * threshold and
+            current - previous > MEMORY_NOISE_FLOOR):
+            regressions.append("%s peak memory: %d kB -> %d kB" % (name, previous, current))
+
+    for regression in regressions:
+        print "REGRESSION %s" % regression
+    return len(regressions) == 0
+
+def benchPhases(o):
+    directory = tempfile.mkdtemp()
+    try:
+        cases = loadCases(o, directory)
+        results = {}
+
+        print "%-28s %17s %17s %17s %10s" % ("phases (ms)", "parse med/p90", "compile med/p90",
+                                             "serialize med/p90", "peak (kB)")
+        for (name, css, path) in cases:
+            timings = [runPhases(css, path) for i in range(0, o.samples)]
+            result = {}
+            line = "%-28s" % name
+            for (index, phase) in enumerate(PHASES):
+                times = [timing[index] * 1000 for timing in timings]
+                result[phase] = { "median": percentile(times, 0.5), "p90": percentile(times, 0.9) }
+                line += " %8.2f %8.2f" % (result[phase]["median"], result[phase]["p90"])
+            result["peakMemory"] = measurePeakMemory(o, name)
+            line += " %10s" % (result["peakMemory"] or "-")
+            results[name] = result
+            print line
+    finally:
+        shutil.rmtree(directory)
+
+    if o.save_baseline:
+        with open(o.save_baseline, "w") as f:
+            json.dump({ "cases": results }, f, indent = 2, sort_keys = True)
+
+    if o.baseline:
+        with open(o.baseline, "r") as f:
+            baseline = json.load(f)["cases"]
+        return compareWithBaseline(results, baseline, o.threshold)
+    return True
+
+# returns the current and the peak memory usage (in kB) of the process. on
+# Linux, ru_maxrss includes the peak of the process that started this one, so
+# the peak of this process itself is read from /proc instead where possible
+def memoryUsage():
+    try:
+        with open("/proc/self/status", "r") as f:
+            fields = dict([line.split(":", 1) for line in f if ":" in line])
+        return (int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0]))
+    except (IOError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak /= 1024 # reported in bytes rather than kB
+        return (peak, peak)
+
+# resets the peak memory usage of the process to its current memory usage,
+# where this is supported, so the peak reached while importing is left out
+def resetPeakMemory():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except IOError:
+        pass
+
+# runs a single case once, and prints how much the peak memory usage of the
+# process grew compared to the memory in use before running it
+def printPeakMemory(o, name):
+    directory = tempfile.mkdtemp()
+    try:
+        for (caseName, css, path) in loadCases(o, directory, name):
+            resetPeakMemory()
+            (before, peak) = memoryUsage()
+            runPhases(css, path)
+            print max(memoryUsage()[1] - before, 0)
+    finally:
+        shutil.rmtree(directory)
+
+BENCHMARKS = [
+    ("serialize", benchSerialize),
+    ("large-block", benchLargeRuleSet),
+    ("memory", benchMemory),
+    ("phases", benchPhases)
+]
+
+if __name__ == "__main__":
+
+    usage = "Usage: %prog [options] [benchmark ...]"
+    optionParser = optparse.OptionParser(usage = usage)
+    optionParser.add_option("", "--size", type = "int", default = 4000,
+                      help = "Number of rule sets in the largest generated stylesheet")
+    optionParser.add_option("", "--repeat", type = "int", default = 3,
+                      help = "Number of times each measurement is repeated")
+    optionParser.add_option("", "--tolerance", type = "float", default = 2.0,
+                      help = "Maximum allowed slowdown per unit of work")
+    optionParser.add_option("", "--samples", type = "int", default = 9,
+                      help = "Number of times every case is run by the phases benchmark")
+    optionParser.add_option("", "--scale", type = "int", default = 1,
+                      help = "Factor by which to scale up the synthetic cases of the phases benchmark")
+    optionParser.add_option("", "--save-baseline", metavar = "FILE",
+                      help = "Write the results of the phases benchmark to a JSON file")
+    optionParser.add_option("", "--baseline", metavar = "FILE",
+                      help = "Compare the results of the phases benchmark against a JSON file")
+    optionParser.add_option("", "--threshold", type = "float", default = 1.25,
+                      help = "Slowdown compared to the baseline reported as a regression")
+    optionParser.add_option("", "--peak-memory", metavar = "CASE",
+                      help = optparse.SUPPRESS_HELP)
+    (o, args) = optionParser.parse_args()
+
+    if o.peak_memory:
+        printPeakMemory(o, o.peak_memory)
+        sys.exit(0)
+
+    passed = True
+    for (name, benchmark) in BENCHMARKS:
+        if len(args) == 0 or name in args:
+            passed = benchmark(o) and passed
+
+    sys.exit(0 if passed else 1)
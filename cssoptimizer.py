@@ -0,0 +1,401 @@
+import re
+
+import cssparser
+
+
+VENDOR_PREFIX_PATTERN = re.compile(r"^-[a-z]+-")
+PSEUDO_PATTERN = re.compile(r"::?(-?[A-Za-z][\w-]*)(\(([^()]*)\))?")
+IMPORTANT_PATTERN = re.compile(r"\s*!\s*important\s*$", re.IGNORECASE)
+
+# values containing functions, hacks or vendor-prefixed keywords may not be
+# understood by every browser, so they could rely on earlier declarations of
+# the same property as fallbacks
+FALLBACK_VALUE_PATTERN = re.compile(r"[(\\]|(^|[^\w-])-[A-Za-z]+-")
+
+# keywords that are valid for longhands, but not within shorthands
+GLOBAL_KEYWORDS = ["inherit", "initial", "unset", "revert"]
+
+# the logical properties, including the old vendor-prefixed ones, which set the
+# same margins, paddings and borders as the physical longhands, depending on
+# the writing mode
+LOGICAL_PROPERTY_PATTERN = re.compile(r"^(-[a-z]+-)?(margin|padding|border)-(inline|block|start|end|before|after)\b")
+
+# the shorthands that longhands are collapsed into, with the longhands in the
+# order of their values, and the other properties that set them
+SHORTHANDS = [
+    ("margin", ["margin-top", "margin-right", "margin-bottom", "margin-left"], []),
+    ("padding", ["padding-top", "padding-right", "padding-bottom", "padding-left"], []),
+    ("border-width", ["border-top-width", "border-right-width", "border-bottom-width", "border-left-width"],
+     ["border", "border-top", "border-right", "border-bottom", "border-left"]),
+    ("border-style", ["border-top-style", "border-right-style", "border-bottom-style", "border-left-style"],
+     ["border", "border-top", "border-right", "border-bottom", "border-left"]),
+    ("border-color", ["border-top-color", "border-right-color", "border-bottom-color", "border-left-color"],
+     ["border", "border-top", "border-right", "border-bottom", "border-left"])
+]
+
+# the pseudo-classes and pseudo-elements every browser in use knows, browsers
+# drop the whole rule set if they don't know one of its selectors. :not() is
+# only known with a simple selector as its argument
+SUPPORTED_PSEUDOS = [
+    "link", "visited", "hover", "active", "focus", "target", "lang", "root", "empty",
+    "enabled", "disabled", "checked", "not", "first-child", "last-child", "only-child",
+    "first-of-type", "last-of-type", "only-of-type", "nth-child", "nth-last-child",
+    "nth-of-type", "nth-last-of-type", "first-line", "first-letter", "before", "after"
+]
+
+# the properties that set, or share their values with, properties whose names
+# start differently, together with those properties. for other properties, the
+# part of the name up to the first dash covers everything they interfere with
+CROSS_ROOT_PROPERTIES = {
+    "inline-size": ["width", "height"],
+    "block-size": ["width", "height"],
+    "inset-inline": ["left", "right", "top", "bottom"],
+    "inset-inline-start": ["left", "right", "top", "bottom"],
+    "inset-inline-end": ["left", "right", "top", "bottom"],
+    "inset-block": ["left", "right", "top", "bottom"],
+    "inset-block-start": ["left", "right", "top", "bottom"],
+    "inset-block-end": ["left", "right", "top", "bottom"],
+    "grid-row-gap": ["row-gap"],
+    "grid-column-gap": ["column-gap"],
+    "page-break-before": ["break-before"],
+    "page-break-after": ["break-after"],
+    "page-break-inside": ["break-inside"],
+    "column-break-before": ["break-before"],
+    "column-break-after": ["break-after"],
+    "column-break-inside": ["break-inside"],
+    "font": ["line-height"],
+    "inset": ["top", "right", "bottom", "left"],
+    "place-content": ["align-content", "justify-content"],
+    "place-items": ["align-items", "justify-items"],
+    "place-self": ["align-self", "justify-self"],
+    "gap": ["row-gap", "column-gap"],
+    "grid-gap": ["gap", "row-gap", "column-gap"],
+    "columns": ["column-width", "column-count"],
+    "white-space": ["text-wrap"],
+    "word-wrap": ["overflow-wrap"]
+}
+
+# the property that resets all others
+ALL_PROPERTY = "all"
+
+# declarations are compared by the string they serialize to with these options
+DECLARATION_KEY_OPTIONS = cssparser.CSSOptions(stripWhiteSpace = True)
+
+# the at-rules whose blocks contain rule sets that cascade just like the rule
+# sets in the style sheet itself
+CASCADING_AT_RULES = ["media", "supports"]
+
+
+# restructures a compiled style sheet to make its output smaller, without
+# changing which declarations apply to which elements, or in which order.
+#
+# level 1 merges neighboring rule sets with the same selector, and merges rule
+# sets with identical declarations into one rule set with a comma-separated
+# selector, provided none of the rule sets in between declare any of the same
+# properties. nothing is moved across at-rules, comments or rule sets that
+# contain anything other than declarations, and selectors with pseudo-classes
+# or pseudo-elements that not every browser knows are never combined with
+# others, as browsers drop the whole rule set if they don't know one of its
+# selectors.
+#
+# level 2 also removes declarations that are overridden by other declarations
+# of the same property in the same rule set, except for those that may serve as
+# fallbacks, and collapses complete sets of margin, padding and border longhands
+# into their shorthands.
+class CSSOptimizer(object):
+    def __init__(self, level = 1):
+        self.level = level
+
+    def optimize(self, styleSheet):
+        self.optimizeRuleSets(styleSheet)
+
+    # optimizes the rule sets amongst the children of the token, every run of
+    # rule sets between two barriers is optimized on its own
+    def optimizeRuleSets(self, token):
+        ruleSets = []
+        for child in token.children[:]:
+            if child.isWhiteSpace():
+                continue
+            if child.isRuleSet() and self.isPlainRuleSet(child):
+                ruleSets.append(child)
+                continue
+
+            self.optimizeRun(ruleSets)
+            ruleSets = []
+            if child.isAtRule() and child.getKeyWord() in CASCADING_AT_RULES and child.getBlock():
+                self.optimizeRuleSets(child.getBlock())
+        self.optimizeRun(ruleSets)
+
+    def optimizeRun(self, ruleSets):
+        if len(ruleSets) == 0:
+            return
+
+        ruleSets = self.mergeEqualSelectors(ruleSets)
+        if self.level >= 2:
+            for ruleSet in ruleSets:
+                self.removeOverriddenDeclarations(ruleSet)
+                self.collapseLonghands(ruleSet)
+        self.mergeEqualDeclarations(ruleSets)
+
+    # merges every rule set into the one before it if they have the same
+    # selector, returns the remaining rule sets
+    def mergeEqualSelectors(self, ruleSets):
+        remaining = [ruleSets[0]]
+        previousKey = cssparser.selectorKey(ruleSets[0].getSelector().getAtoms())
+        for ruleSet in ruleSets[1:]:
+            key = cssparser.selectorKey(ruleSet.getSelector().getAtoms())
+            if key == previousKey:
+                self.moveDeclarations(ruleSet, remaining[-1])
+            else:
+                remaining.append(ruleSet)
+                previousKey = key
+        return remaining
+
+    # merges every rule set into an earlier one with the same declarations, as
+    # long as no rule set in between declares properties that interfere with
+    # them, because then moving the declarations up doesn't change the cascade
+    def mergeEqualDeclarations(self, ruleSets):
+        lastUses = {} # the index of the last rule set declaring properties, by root
+        lastUse = -1 # the index of the last rule set declaring any property
+        targets = {} # the index of the last rule set that can be merged into, by key
+        for i in range(0, len(ruleSets)):
+            ruleSet = ruleSets[i]
+            declarations = ruleSet.getDeclarations()
+            if len(declarations) == 0:
+                continue
+
+            key = tuple([declaration.toString(DECLARATION_KEY_OPTIONS) for declaration in declarations])
+            roots = set()
+            for declaration in declarations:
+                roots.update(self.propertyRoots(declaration))
+            canMerge = not self.hasUnsupportedPseudo(ruleSet)
+            if canMerge and key in targets:
+                target = targets[key]
+                if ALL_PROPERTY in roots:
+                    interfering = lastUse != target
+                else:
+                    interfering = lastUses.get(ALL_PROPERTY, -1) > target
+                    for root in roots:
+                        if lastUses[root] != target:
+                            interfering = True
+                            break
+                if not interfering:
+                    self.addSelectors(ruleSet, ruleSets[target])
+                    self.removeRuleSet(ruleSet)
+                    continue
+
+            for root in roots:
+                lastUses[root] = i
+            lastUse = i
+            if canMerge:
+                targets[key] = i
+
+    # removes the declarations for which a declaration of the same property takes
+    # precedence. the declarations are visited from the one that takes precedence
+    # over all others down, and a declaration is only removed if one that takes
+    # precedence over it and is kept has the same value, or if neither value
+    # could be meant for some browsers only
+    def removeOverriddenDeclarations(self, ruleSet):
+        declarations = ruleSet.getDeclarations()
+        priorities = []
+        for i in range(0, len(declarations)):
+            (value, important) = self.splitValue(declarations[i])
+            priorities.append((important, i))
+        priorities.sort(reverse = True)
+
+        kept = {} # the values of the kept declarations, by property
+        for (important, i) in priorities:
+            declaration = declarations[i]
+            name = declaration.getProperty().data.lower()
+            (value, important) = self.splitValue(declaration)
+            isFallback = self.isFallbackValue(value)
+            overridden = False
+            for keptValue in kept.get(name, []):
+                if value == keptValue or not (isFallback or self.isFallbackValue(keptValue)):
+                    overridden = True
+                    break
+            if overridden:
+                self.removeDeclaration(declaration)
+            else:
+                kept.setdefault(name, []).append(value)
+
+    # replaces the longhands of every shorthand by the shorthand, if all of them
+    # are declared exactly once, with the same importance and simple values, and
+    # no other declarations in the rule set set any of them
+    def collapseLonghands(self, ruleSet):
+        declarations = ruleSet.getDeclarations()
+        byName = {}
+        for declaration in declarations:
+            byName.setdefault(declaration.getProperty().data.lower(), []).append(declaration)
+
+        for (shorthand, longhands, others) in SHORTHANDS:
+            if shorthand in byName:
+                continue
+            found = False
+            for name in others:
+                if name in byName:
+                    found = True
+            root = shorthand.split("-")[0]
+            for name in byName:
+                match = LOGICAL_PROPERTY_PATTERN.match(name)
+                if match and match.group(2) == root:
+                    found = True
+            if found:
+                continue
+
+            values = []
+            importance = set()
+            for name in longhands:
+                if len(byName.get(name, [])) != 1:
+                    break
+                (value, important) = self.splitValue(byName[name][0])
+                if (" " in value or value.lower() in GLOBAL_KEYWORDS or
+                    self.isFallbackValue(value)):
+                    break
+                values.append(value)
+                importance.add(important)
+            if len(values) != len(longhands) or len(importance) != 1:
+                continue
+
+            # top, right, bottom, left -> top, right, bottom -> top, right -> top
+            numValues = 4
+            if values[3] == values[1]:
+                numValues = 3
+                if values[2] == values[0]:
+                    numValues = 2
+                    if values[1] == values[0]:
+                        numValues = 1
+
+            first = byName[longhands[0]][0]
+            tokens = []
+            for i in range(0, numValues):
+                if i > 0:
+                    tokens.append(cssparser.CSSWhiteSpaceToken(None, " "))
+                tokens.extend(self.valueTokens(byName[longhands[i]][0]))
+            if importance.pop():
+                tokens.append(cssparser.CSSWhiteSpaceToken(None, " "))
+                tokens.append(cssparser.CSSIdentifierToken(None, "!important"))
+            first.getProperty().data = shorthand
+            first.getValue().setChildren(tokens)
+            for name in longhands[1:]:
+                self.removeDeclaration(byName[name][0])
+
+    # returns the value of the declaration as a string, without the !important
+    # annotation, together with whether the declaration is important
+    def splitValue(self, declaration):
+        value = declaration.getValue().toString(DECLARATION_KEY_OPTIONS)
+        match = IMPORTANT_PATTERN.search(value)
+        if match:
+            return (value[:match.start()], True)
+        return (value, False)
+
+    def isFallbackValue(self, value):
+        return FALLBACK_VALUE_PATTERN.search(value) != None
+
+    # returns the tokens of the value of the declaration, without the !important
+    # annotation. the tokens are not cloned, as clones of evaluated variables lose
+    # their values
+    def valueTokens(self, declaration):
+        tokens = declaration.getValue().getStrippedChildren()
+        while len(tokens) > 0 and (tokens[-1].isWhiteSpace() or tokens[-1].isDelimiter("!") or
+                                   (tokens[-1].isIdentifier() and
+                                    tokens[-1].data.lower() in ["!important", "important"])):
+            tokens.pop()
+        return tokens
+
+    # removes the declaration from its rule set, together with the semicolon
+    # following it and the whitespace preceding it
+    def removeDeclaration(self, declaration):
+        next = declaration.getNextSibling(True)
+        if next and next.isDelimiter(";"):
+            next.remove()
+        previous = declaration.getPreviousSibling()
+        if previous and previous.isWhiteSpace():
+            previous.remove()
+        declaration.remove()
+
+    # returns whether the rule set only contains declarations, which excludes
+    # rule sets containing comments, which could be important
+    def isPlainRuleSet(self, ruleSet):
+        for child in ruleSet.children:
+            if not (child.isSelector() or child.isDeclaration() or
+                    child.isDelimiter() or child.isWhiteSpace()):
+                return False
+        return True
+
+    # returns whether the selector of the rule set has pseudo-classes or
+    # pseudo-elements that some browsers may not know
+    def hasUnsupportedPseudo(self, ruleSet):
+        for match in PSEUDO_PATTERN.finditer(cssparser.selectorKey(ruleSet.getSelector().getAtoms())):
+            name = match.group(1).lower()
+            if name not in SUPPORTED_PSEUDOS:
+                return True
+            if name == "not" and (match.group(2) == None or re.search(r"[\s,>+~]", match.group(3))):
+                return True
+        return False
+
+    # returns the parts of the names of the properties the declaration may set
+    # that they have in common with their shorthand and longhand properties, and
+    # with their vendor-prefixed versions. declarations of properties with the
+    # same root are assumed to interfere with each other
+    def propertyRoots(self, declaration):
+        name = VENDOR_PREFIX_PATTERN.sub("", declaration.getProperty().data.lower())
+        roots = set([name.split("-")[0]])
+        for longhand in CROSS_ROOT_PROPERTIES.get(name, []):
+            roots.add(longhand.split("-")[0])
+        return roots
+
+    # adds the sub-selectors of the source rule set that the target doesn't have
+    # yet to the selector of the target
+    def addSelectors(self, source, target):
+        selector = target.getSelector()
+        keys = set([cssparser.selectorKey(subSelector) for subSelector in selector.getSubSelectors()])
+        atoms = list(selector.getAtoms())
+        trailingSpace = len(atoms) > 0 and atoms[-1].isWhiteSpace()
+        if trailingSpace:
+            atoms.pop()
+        for subSelector in source.getSelector().getSubSelectors():
+            key = cssparser.selectorKey(subSelector)
+            if key not in keys:
+                keys.add(key)
+                atoms.append(cssparser.SELECTOR_COMMA)
+                atoms.extend(subSelector)
+        if trailingSpace:
+            atoms.append(cssparser.SELECTOR_SPACE)
+        selector.setAtoms(atoms)
+
+    # moves the declarations of the source rule set to the end of the target
+    # rule set, and removes the source
+    def moveDeclarations(self, source, target):
+        children = source.children
+        start = 0
+        while start < len(children) and not children[start].isDelimiter("{"):
+            start += 1
+        end = len(children)
+        if end > start + 1 and children[-1].isDelimiter("}"):
+            end -= 1
+        while start + 1 < end and children[start + 1].isWhiteSpace():
+            start += 1
+        body = children[start + 1:end]
+        self.removeRuleSet(source)
+
+        index = len(target.children)
+        if index > 0 and target.children[-1].isDelimiter("}"):
+            index -= 1
+        last = index - 1
+        while last >= 0 and target.children[last].isWhiteSpace():
+            last -= 1
+        if last >= 0 and target.children[last].isDeclaration():
+            target.insertAt(last + 1, cssparser.CSSDelimiterToken(target, ";"))
+            index += 1
+
+        for child in body:
+            target.insertAt(index, child)
+            index += 1
+
+    # removes the rule set together with the whitespace preceding it
+    def removeRuleSet(self, ruleSet):
+        previous = ruleSet.getPreviousSibling()
+        if previous and previous.isWhiteSpace():
+            previous.remove()
+        ruleSet.remove()
@@ -1,3 +1,4 @@
+import bisect
 import copy
 import re
 import string
@@ -5,7 +6,8 @@ import string
 
 class CSSOptions(object):
     def __init__(self, options = None, stripWhiteSpace = False, stripComments = False, minimizeValues = False,
-                 stripExtraSemicolons = False, colorize = False, compileScss = False, stripQuotes = False, importCss = True, **keywords):
+                 stripExtraSemicolons = False, colorize = False, compileScss = False, stripQuotes = False, importCss = True,
+                 fastTokenizer = True, optimizeLevel = 0, **keywords):
         if options:
             self.stripWhiteSpace = stripWhiteSpace if "stripWhiteSpace" in keywords.keys() else options.stripWhiteSpace
             self.stripComments = stripComments if "stripComments" in keywords.keys() else options.stripComments
@@ -15,6 +17,8 @@ class CSSOptions(object):
             self.compileScss = compileScss if "compileScss" in keywords.keys() else options.compileScss
             self.stripQuotes = stripQuotes if "stripQuotes" in keywords.keys() else options.stripQuotes
             self.importCss = importCss if "importCss" in keywords.keys() else options.importCss
+            self.fastTokenizer = fastTokenizer if "fastTokenizer" in keywords.keys() else options.fastTokenizer
+            self.optimizeLevel = optimizeLevel if "optimizeLevel" in keywords.keys() else options.optimizeLevel
         else:
             self.stripWhiteSpace = stripWhiteSpace
             self.stripComments = stripComments
@@ -24,21 +28,48 @@ class CSSOptions(object):
             self.compileScss = compileScss
             self.stripQuotes = stripQuotes
             self.importCss = importCss
+            self.fastTokenizer = fastTokenizer
+            self.optimizeLevel = optimizeLevel
+
+    # returns the flags that influence the token tree produced by the parser
+    # (as opposed to the flags that only influence compiling or serializing)
+    def parsingFlags(self):
+        return (self.compileScss, self.skipIgnorableTokens())
+
+    # returns whether the parser can leave out whitespace and comments that
+    # would be stripped when serializing anyway
+    def skipIgnorableTokens(self):
+        return self.stripWhiteSpace and self.stripComments
 
 
 def colorize(string, color):
     return "\x1B[" + color + "m" + string + "\x1B[00m"
 
+# appends the escape sequence that starts colorized output to an output list
+def startColor(output, color):
+    output.append("\x1B[" + color + "m")
+
+# appends the escape sequence that ends colorized output to an output list
+def endColor(output):
+    output.append("\x1B[00m")
+
 def minimizeColorValue(token):
     import scssvariables
     variable = scssvariables.SCSSColor(token)
     return variable.toString()
 
 def tokenListToString(tokenList, options = CSSOptions()):
-    string = ""
+    output = []
     for token in tokenList:
-        string += token.toString(options)
-    return string
+        token.serialize(output, options)
+    return "".join(output)
+
+# returns the string by which a (sub-)selector is known, regardless of the
+# whitespace in it
+def selectorKey(tokenList):
+    return tokenListToString(tokenList, SELECTOR_KEY_OPTIONS)
+
+SELECTOR_KEY_OPTIONS = CSSOptions(stripWhiteSpace = True)
 
 
 CSS_EOF = "EOF"
@@ -56,6 +87,45 @@ CSS_LIST_VALUE = "LIST"
 CSS_DELIM_VALUE = "DELIM"
 SCSS_VARIABLE_VALUE = "VARIABLE"
 
+NAME_START_CHARACTERS = string.ascii_letters + "_"
+NAME_CHARACTERS = string.ascii_letters + "_-0123456789"
+DIGIT_CHARACTERS = "0123456789"
+NEWLINE_CHARACTERS = "\x0a\x0c\x0d"
+WHITESPACE_CHARACTERS = "\x09\x0a\x0c\x0d\x20"
+
+# character classes used by the fast tokenizer, indexed by character code (only
+# ASCII characters are classified, everything else goes through CSSStream)
+NAME_START_CLASS = 1
+NAME_CLASS = 2
+DIGIT_CLASS = 4
+WHITESPACE_CLASS = 8
+
+CHARACTER_CLASSES = [0] * 128
+for character in NAME_START_CHARACTERS:
+    CHARACTER_CLASSES[ord(character)] |= NAME_START_CLASS
+for character in NAME_CHARACTERS:
+    CHARACTER_CLASSES[ord(character)] |= NAME_CLASS
+for character in DIGIT_CHARACTERS:
+    CHARACTER_CLASSES[ord(character)] |= DIGIT_CLASS
+for character in WHITESPACE_CHARACTERS:
+    CHARACTER_CLASSES[ord(character)] |= WHITESPACE_CLASS
+
+IDENTIFIER_PATTERN = re.compile(r"-?[A-Za-z_][A-Za-z0-9_\-]*")
+NAME_PATTERN = re.compile(r"[A-Za-z0-9_\-]+")
+NUMBER_PATTERN = re.compile(r"-?(?:[0-9]|\.(?=[0-9]))+")
+WHITESPACE_PATTERN = re.compile(r"[\t\n\f\r ]*")
+SINGLE_QUOTED_STRING_PATTERN = re.compile(r"'[^'\\]*'")
+DOUBLE_QUOTED_STRING_PATTERN = re.compile(r'"[^"\\]*"')
+SINGLE_LINE_COMMENT_PATTERN = re.compile(r"[^\n\f\r]*")
+
+# patterns used for finding delimiters, by character range
+DELIMITER_PATTERNS = {}
+
+# the delimiters the fast tokenizer keeps an index of, for looking ahead
+INDEXED_DELIMITERS = "{};:"
+INDEXED_DELIMITER_PATTERN = re.compile("[%s]" % re.escape(INDEXED_DELIMITERS))
+INTERPOLATION_OR_INDEXED_DELIMITER_PATTERN = re.compile("#\\{|[%s]" % re.escape(INDEXED_DELIMITERS))
+
 
 class CSSParseError(Exception):
     def __init__(self, message, stream = None, token = None):
@@ -75,9 +145,18 @@ class CSSParseError(Exception):
         Exception.__init__(self, message)
 
 
+# creates the stream to tokenize buffer with, depending on whether the fast
+# tokenizer is enabled in the options
+def createStream(buffer, options = CSSOptions()):
+    if options.fastTokenizer:
+        return CSSFastStream(buffer, options)
+    else:
+        return CSSStream(buffer, options)
+
+
 class CSSParser(object):
     def parse(self, css, options = CSSOptions()):
-        stream = CSSStream(css, options)
+        stream = createStream(css, options)
         styleSheet = CSSStyleSheetToken()
         token = styleSheet
         while not stream.isEndOfFile():
@@ -96,62 +175,61 @@ class CSSStream(object):
     def current(self):
         return self.peek(0)
 
+    # all take methods return a slice of the buffer rather than concatenating
+    # the characters they take one by one, which would be quadratic
     def take(self, num = 1):
-        characters = ""
+        start = self.pos
         while num > 0:
             character = self.current()
             if character == CSS_EOF:
                 return character
             self.advance()
             if ord(character) == 13 and ord(self.current()) == 10:
-                character += self.take()
+                self.take()
             elif self.isEscape(-1):
-                character += self.take()
-            characters += character
+                self.take()
             num -= 1
-        return characters
+        return self.buffer[start:self.pos]
 
     def takeIdentifier(self):
         if not self.isIdentifierStart():
             raise CSSParseError("Current character is not an identifier", self)
 
-        characters = self.take()
-        if self.options.compileScss and characters == "#":
-            characters = ""
-            self.pos -= 1 # this hurts, but the alternative is even less elegant
+        start = self.pos
+        if not (self.options.compileScss and self.current() == "#"):
+            self.take()
         while self.isNameChar():
             if (self.options.compileScss and
                 self.current() == "#" and self.peek(1) == "{"):
-                characters += self.take(2)
+                self.take(2)
                 while self.current() != "}" and not self.isEndOfFile():
-                    characters += self.take()
+                    self.take()
                 if self.current() != "}":
                     break
-            characters += self.take()
-        return characters
+            self.take()
+        return self.buffer[start:self.pos]
 
     def takeName(self):
         if not self.isNameChar():
             raise CSSParseError("Current character is not a name", self)
 
-        characters = self.take()
+        start = self.pos
+        self.take()
         while self.isNameChar():
-            characters += self.take()
-        return characters
+            self.take()
+        return self.buffer[start:self.pos]
 
     def takeNumber(self):
         if not self.isNumberStart():
             raise CSSParseError("Current character is not a number", self)
 
-        characters = self.take()
-        numDots = 0
+        start = self.pos
+        self.take()
         while self.isNumberChar():
-            character = self.take()
-            if character == ".":
-                numDots += 1
-            characters += character
+            self.take()
+        characters = self.buffer[start:self.pos]
 
-        if characters[-1] == "." or numDots > 1:
+        if characters[-1] == "." or characters.count(".", 1) > 1:
             raise CSSParseError("Error parsing number", self)
 
         return characters
@@ -169,41 +247,47 @@ class CSSStream(object):
         if not self.isUrlChar():
             raise CSSParseError("Current character is not a URI", self)
 
-        characters = self.take()
+        start = self.pos
+        self.take()
         while self.isUrlChar():
-            characters += self.take()
-        return characters
+            self.take()
+        return self.buffer[start:self.pos]
 
     def takeString(self):
-        if self.current() == "'":
-            characters = self.take()
-            while self.current() != "'":
-                if self.current() == CSS_EOF:
-                    raise CSSParseError("Unexpected end-of-file", self)
-
-                characters += self.take()
-
-            characters += self.take()
-            return characters
+        quote = self.current()
+        if quote != "'" and quote != "\"":
+            raise CSSParseError("Current character is not a string", self)
 
-        if self.current() == "\"":
-            characters = self.take()
-            while self.current() != "\"":
-                if self.current() == CSS_EOF:
-                    raise CSSParseError("Unexpected end-of-file", self)
+        start = self.pos
+        self.take()
+        while self.current() != quote:
+            if self.current() == CSS_EOF:
+                raise CSSParseError("Unexpected end-of-file", self)
 
-                characters += self.take()
+            self.take()
 
-            characters += self.take()
-            return characters
-
-        raise CSSParseError("Current character is not a string", self)
+        self.take()
+        return self.buffer[start:self.pos]
 
     def takeWhiteSpace(self):
-        characters = ""
+        start = self.pos
         while not self.isEndOfFile() and self.isWhiteSpaceChar():
-            characters += self.take()
-        return characters
+            self.take()
+        return self.buffer[start:self.pos]
+
+    # takes the remainder of a comment whose opening characters have already
+    # been taken
+    def takeCommentBody(self, singleLine = False):
+        start = self.pos
+        if singleLine:
+            while not (self.isEndOfFile() or self.isNewline()):
+                self.take()
+        else:
+            while not (self.isEndOfFile() or self.isCommentEnd()):
+                self.take()
+            if self.isCommentEnd():
+                self.take(2)
+        return self.buffer[start:self.pos]
 
     def advance(self):
         if self.isNewline():
@@ -222,12 +306,9 @@ class CSSStream(object):
         return self.buffer[pos]
 
     def peekRange(self, offset = 0, num = 1):
-        characters = ""
-        for i in range(0, num):
-            character = self.peek(offset + i)
-            if character != CSS_EOF:
-                characters += character
-        return characters
+        start = max(self.pos + offset, 0)
+        end = max(self.pos + offset + num, 0)
+        return self.buffer[start:end]
 
     def findFirstDelimiter(self, characterRange, offset = 0):
         character = self.peek(offset)
@@ -258,13 +339,13 @@ class CSSStream(object):
                 (self.peek(offset) == "-" and self.isNameStart(offset + 1)))
 
     def isNameStart(self, offset = 0):
-        return (self.peek(offset) in string.ascii_letters + "_" or
+        return (self.peek(offset) in NAME_START_CHARACTERS or
                 self.isNonAscii(offset) or
                 self.isEscape(offset) or
                 (self.options.compileScss and self.peek(offset) == "#" and self.peek(offset + 1) == "{"))
 
     def isNameChar(self, offset = 0):
-        return (self.peek(offset) in string.ascii_letters + "_-0123456789" or
+        return (self.peek(offset) in NAME_CHARACTERS or
                 self.isNonAscii(offset) or
                 self.isEscape(offset) or
                 (self.options.compileScss and self.peek(offset) == "#"))
@@ -275,8 +356,8 @@ class CSSStream(object):
 
     def isNumberChar(self, offset = 0):
         character = self.peek(offset)
-        return (character in "0123456789" or
-                (character == "." and self.peek(offset + 1) in "0123456789"))
+        return (character in DIGIT_CHARACTERS or
+                (character == "." and self.peek(offset + 1) in DIGIT_CHARACTERS))
 
     def isStringStart(self, offset = 0):
         return self.peek(offset) in "'\""
@@ -320,10 +401,10 @@ class CSSStream(object):
                 (val >= 65536 and val <= 131071))
 
     def isNewline(self, offset = 0):
-        return self.peek(offset) in "\x0a\x0c\x0d"
+        return self.peek(offset) in NEWLINE_CHARACTERS
 
     def isWhiteSpaceChar(self, offset = 0):
-        return self.peek(offset) in "\x09\x0a\x0c\x0d\x20"
+        return self.peek(offset) in WHITESPACE_CHARACTERS
 
     def isCommentStart(self, offset = 0):
         if self.peek(offset) != "/":
@@ -335,21 +416,252 @@ class CSSStream(object):
         return self.peek(offset) == "*" and self.peek(offset + 1) == "/"
 
 
+# stream that tokenizes whole runs of characters at once using precompiled
+# patterns and a character class table, instead of examining every character
+# through peek() and take(). whenever a run contains a character that needs
+# special treatment (escapes, non-ASCII characters, interpolation) the stream
+# falls back to the character-by-character implementation of CSSStream, so both
+# streams always produce exactly the same tokens.
+class CSSFastStream(CSSStream):
+    def __init__(self, buffer, options = CSSOptions()):
+        self.buffer = buffer
+        self.options = options
+        self.pos = 0
+        self.length = len(buffer)
+        self.delimiterPositions = None
+        self.interpolationStarts = None
+        self.interpolationEnds = None
+
+    # line and column are only needed for error reporting, so rather than
+    # keeping track of them for every character, they are derived from the
+    # position when asked for
+    @property
+    def line(self):
+        pos = min(self.pos, self.length)
+        return (1 + self.buffer.count("\x0a", 0, pos) + self.buffer.count("\x0c", 0, pos) +
+                self.buffer.count("\x0d", 0, pos))
+
+    @property
+    def column(self):
+        pos = min(self.pos, self.length)
+        return pos - max(self.buffer.rfind("\x0a", 0, pos), self.buffer.rfind("\x0c", 0, pos),
+                         self.buffer.rfind("\x0d", 0, pos))
+
+    def current(self):
+        if self.pos < self.length:
+            return self.buffer[self.pos]
+        return CSS_EOF
+
+    def peek(self, offset):
+        pos = self.pos + offset
+        if pos >= self.length:
+            return CSS_EOF
+        if pos < 0:
+            return ""
+        return self.buffer[pos]
+
+    def advance(self):
+        self.pos += 1
+
+    def isEndOfFile(self, offset = 0):
+        return self.pos + offset >= self.length
+
+    def take(self, num = 1):
+        if num == 1 and self.pos < self.length:
+            character = self.buffer[self.pos]
+            if character != "\\" and character != "\x0d":
+                self.pos += 1
+                return character
+        return CSSStream.take(self, num)
+
+    def takeIdentifier(self):
+        return self.takeRun(IDENTIFIER_PATTERN) or CSSStream.takeIdentifier(self)
+
+    def takeName(self):
+        return self.takeRun(NAME_PATTERN) or CSSStream.takeName(self)
+
+    def takeNumber(self):
+        match = NUMBER_PATTERN.match(self.buffer, self.pos)
+        if match and match.group().count(".", 1) <= 1:
+            self.pos = match.end()
+            return match.group()
+        return CSSStream.takeNumber(self) # also takes care of raising errors
+
+    def takeString(self):
+        character = self.current()
+        if character == "'":
+            match = SINGLE_QUOTED_STRING_PATTERN.match(self.buffer, self.pos)
+        elif character == "\"":
+            match = DOUBLE_QUOTED_STRING_PATTERN.match(self.buffer, self.pos)
+        else:
+            match = None
+        if match:
+            self.pos = match.end()
+            return match.group()
+        return CSSStream.takeString(self)
+
+    def takeWhiteSpace(self):
+        match = WHITESPACE_PATTERN.match(self.buffer, self.pos)
+        self.pos = match.end()
+        return match.group()
+
+    def takeCommentBody(self, singleLine = False):
+        if singleLine:
+            end = SINGLE_LINE_COMMENT_PATTERN.match(self.buffer, self.pos).end()
+        else:
+            end = self.buffer.find("*/", self.pos)
+            end = self.length if end == -1 else end + 2
+        if self.buffer.find("\\", self.pos, end) == -1:
+            characters = self.buffer[self.pos:end]
+            self.pos = end
+            return characters
+        return CSSStream.takeCommentBody(self, singleLine)
+
+    # takes the characters matched by pattern, provided the character-by-
+    # character implementation would not have continued past the match
+    def takeRun(self, pattern):
+        match = pattern.match(self.buffer, self.pos)
+        if not match:
+            return None
+        end = match.end()
+        if end < self.length:
+            character = self.buffer[end]
+            if (character == "\\" or ord(character) >= 128 or
+                (self.options.compileScss and character == "#")):
+                return None
+        self.pos = end
+        return match.group()
+
+    # looking ahead for delimiters is done for nearly every statement in a block,
+    # so rather than searching the buffer over and over again, the positions of
+    # the delimiters are indexed once and looked up from there on
+    def findFirstDelimiter(self, characterRange, offset = 0):
+        pos = self.pos + offset
+        if self.delimiterPositions == None:
+            self.indexDelimiters()
+        for character in characterRange:
+            if character not in INDEXED_DELIMITERS:
+                return self.searchDelimiter(characterRange, offset)
+        i = bisect.bisect_right(self.interpolationStarts, pos) - 1
+        if i >= 0 and pos <= self.interpolationEnds[i]:
+            return self.searchDelimiter(characterRange, offset) # looking ahead from within an interpolation
+
+        positions = self.delimiterPositions
+        buffer = self.buffer
+        for i in xrange(bisect.bisect_left(positions, pos), len(positions)):
+            character = buffer[positions[i]]
+            if character in characterRange:
+                return (character, positions[i] - self.pos)
+        return (CSS_EOF, self.length - self.pos)
+
+    # indexes the positions of all delimiters in the buffer, except for those
+    # in interpolations, which findFirstDelimiter() skips
+    def indexDelimiters(self):
+        self.interpolationStarts = []
+        self.interpolationEnds = []
+        if not self.options.compileScss or self.buffer.find("#{") == -1:
+            self.delimiterPositions = [match.start() for match in INDEXED_DELIMITER_PATTERN.finditer(self.buffer)]
+            return
+
+        self.delimiterPositions = []
+        pos = 0
+        while True:
+            match = INTERPOLATION_OR_INDEXED_DELIMITER_PATTERN.search(self.buffer, pos)
+            if not match:
+                return
+            if match.group() != "#{":
+                self.delimiterPositions.append(match.start())
+                pos = match.end()
+                continue
+            end = self.buffer.find("}", match.end())
+            if end == -1:
+                end = self.length
+            self.interpolationStarts.append(match.start() + 1)
+            self.interpolationEnds.append(end)
+            pos = end + 1
+
+    def searchDelimiter(self, characterRange, offset):
+        pattern = DELIMITER_PATTERNS.get(characterRange)
+        if pattern == None:
+            pattern = re.compile("#\\{|[%s]" % re.escape(characterRange))
+            DELIMITER_PATTERNS[characterRange] = pattern
+
+        pos = self.pos + offset
+        while True:
+            match = pattern.search(self.buffer, pos)
+            if not match:
+                return (CSS_EOF, self.length - self.pos)
+            if match.group() != "#{":
+                return (match.group(), match.start() - self.pos)
+            if self.options.compileScss:
+                # skip interpolations, just like the identifiers containing
+                # them are skipped by CSSStream
+                end = self.buffer.find("}", match.end())
+                if end == -1:
+                    return (CSS_EOF, self.length - self.pos)
+                pos = end + 1
+            else:
+                pos = match.start() + 1
+
+    # looks up the character class of the character at the given offset, or
+    # returns None if the character should be classified by CSSStream
+    def characterClass(self, offset):
+        pos = self.pos + offset
+        if pos < 0 or pos >= self.length:
+            return None
+        value = ord(self.buffer[pos])
+        if value >= 128 or value == 35 or value == 92: # non-ASCII, # or \
+            return None
+        return CHARACTER_CLASSES[value]
+
+    def isNameStart(self, offset = 0):
+        characterClass = self.characterClass(offset)
+        if characterClass == None:
+            return CSSStream.isNameStart(self, offset)
+        return characterClass & NAME_START_CLASS != 0
+
+    def isNameChar(self, offset = 0):
+        characterClass = self.characterClass(offset)
+        if characterClass == None:
+            return CSSStream.isNameChar(self, offset)
+        return characterClass & NAME_CLASS != 0
+
+    def isNumberChar(self, offset = 0):
+        characterClass = self.characterClass(offset)
+        if characterClass == None:
+            return CSSStream.isNumberChar(self, offset)
+        if characterClass & DIGIT_CLASS:
+            return True
+        return self.peek(offset) == "." and self.peek(offset + 1) in DIGIT_CHARACTERS
+
+    def isWhiteSpaceChar(self, offset = 0):
+        characterClass = self.characterClass(offset)
+        if characterClass == None:
+            return CSSStream.isWhiteSpaceChar(self, offset)
+        return characterClass & WHITESPACE_CLASS != 0
+
+
 class CSSToken(object):
-    def __init__(self, allowedChildren, parent):
-        self.allowedChildren = allowedChildren
+    __slots__ = ("parent", "children", "data", "indexHint", "numIndexedChildren")
+
+    def __init__(self, parent):
         self.parent = parent
         self.children = []
         self.data = ""
+        self.indexHint = 0
+        self.numIndexedChildren = 0
 
     # adds a child token to the token
     def add(self, token):
         if len(self.data) > 0:
             raise CSSParseError("Cannot consume data and add children to the same token", token = self)
 
-        if not isinstance(token, tuple(self.allowedChildren)):
+        if not isinstance(token, self.allowedChildren):
             raise CSSParseError("Cannot add %s to %s" % (token.__class__, self.__class__), token = self)
 
+        token.indexHint = len(self.children)
+        if self.numIndexedChildren == token.indexHint:
+            self.numIndexedChildren += 1
         self.children.append(token)
         self.adopt(token)
 
@@ -380,10 +692,12 @@ class CSSToken(object):
         if len(self.data) > 0:
             raise CSSParseError("Cannot consume data and add children to the same token", token = self)
 
-        if not isinstance(token, tuple(self.allowedChildren)):
+        if not isinstance(token, self.allowedChildren):
             raise CSSParseError("Cannot add %s to %s" % (token.__class__, self.__class__), token = self)
 
         self.children.insert(index, token)
+        token.indexHint = index
+        self.numIndexedChildren = min(self.numIndexedChildren, index + 1)
         self.adopt(token)
 
     # adds a clone (copy) of token as a child at the given index
@@ -392,13 +706,15 @@ class CSSToken(object):
 
     # adds a token as a child as a replacement for one or more existing children
     def replaceAt(self, index, howMany, token):
-        if not isinstance(token, tuple(self.allowedChildren)):
+        if not isinstance(token, self.allowedChildren):
             raise CSSParseError("Cannot add %s to %s" % (token.__class__, self.__class__), token = self)
 
         while howMany > 1:
             self.children.remove(index)
+            self.numIndexedChildren = min(self.numIndexedChildren, index)
             howMany -= 1
         self.children[index] = token
+        token.indexHint = index
         self.adopt(token)
 
     # replaces this token with another token
@@ -406,7 +722,9 @@ class CSSToken(object):
         if self.parent == None:
             raise CSSParseError("Cannot replace the root token", token = self)
 
-        self.parent.children[self.ownIndex()] = token
+        index = self.ownIndex()
+        self.parent.children[index] = token
+        token.indexHint = index
         self.parent.adopt(token)
 
     # creates and adds a child token
@@ -442,11 +760,15 @@ class CSSToken(object):
     def removeChildAt(self, index):
         self.reject(self.children[index])
         self.children.pop(index)
+        self.numIndexedChildren = min(self.numIndexedChildren, index)
 
     # removes a child token from the children list
     def removeChild(self, token):
-        self.children.remove(token)
-        self.reject(token)
+        if token.parent is self:
+            self.removeChildAt(token.ownIndex())
+        else:
+            self.children.remove(token)
+            self.reject(token)
 
     # removes the token from its parent's children list
     def remove(self):
@@ -458,6 +780,7 @@ class CSSToken(object):
     # replaces all children from a given array of tokens
     def setChildren(self, tokens):
         self.children = tokens
+        self.numIndexedChildren = 0
         for child in self.children:
             self.adopt(child)
 
@@ -465,6 +788,8 @@ class CSSToken(object):
     # that should process the next character
     def process(self, stream, options = CSSOptions()):
         if stream.isCommentStart():
+            if options.skipIgnorableTokens() and self.skipIgnorableInput(stream):
+                return self.processAfterSkipping(stream, options)
             parent = self if CSSCommentToken in self.allowedChildren else self.parent
             token = CSSCommentToken(parent)
             token.consume(stream.take(2))
@@ -472,6 +797,8 @@ class CSSToken(object):
             return token
         if stream.isWhiteSpaceChar():
             if CSSWhiteSpaceToken in self.allowedChildren:
+                if options.skipIgnorableTokens() and self.skipIgnorableInput(stream):
+                    return self.processAfterSkipping(stream, options)
                 return self.createChild(CSSWhiteSpaceToken)
         if options.compileScss and stream.isVariableStart():
             if SCSSAssignmentToken in self.allowedChildren:
@@ -480,6 +807,37 @@ class CSSToken(object):
                 return self.createChild(SCSSVariableToken)
         return self
 
+    # skips over comments and whitespace that would be stripped from the output
+    # anyway, without creating tokens for them, returns whether anything was
+    # skipped. comments starting with /*! are always kept
+    def skipIgnorableInput(self, stream):
+        skipped = False
+        while True:
+            if stream.isCommentStart() and stream.peek(2) != "!":
+                start = stream.take(2)
+                stream.takeCommentBody(start[1] == "/")
+            elif (stream.isWhiteSpaceChar() and CSSWhiteSpaceToken in self.allowedChildren and
+                  not self.isWhiteSpaceSignificant()):
+                stream.takeWhiteSpace()
+            else:
+                return skipped
+            skipped = True
+
+    # processes the character following skipped input, as if the skipped input
+    # was never there
+    def processAfterSkipping(self, stream, options):
+        if stream.isEndOfFile():
+            return None
+        return self.process(stream, options)
+
+    # returns whether whitespace following the current children could end up in
+    # the output when whitespace is stripped
+    def isWhiteSpaceSignificant(self):
+        if len(self.children) == 0:
+            return False
+        lastChild = self.children[-1]
+        return not (lastChild.isWhiteSpace() or lastChild.isBoundary())
+
     # consumes input characters and adds them to the token data
     def consume(self, characters):
         if len(self.children) > 0:
@@ -577,7 +935,7 @@ class CSSToken(object):
             return False
 
         siblings = self.parent.children
-        index = siblings.index(self)
+        index = self.ownIndex()
         while (index > 0 and
                ignoreWhiteSpace and (siblings[index - 1].isWhiteSpace() or siblings[index - 1].isComment())):
             index -= 1
@@ -589,7 +947,7 @@ class CSSToken(object):
             return False
 
         siblings = self.parent.children
-        index = siblings.index(self)
+        index = self.ownIndex()
         while (index < len(siblings) - 1 and
                ignoreWhiteSpace and (siblings[index + 1].isWhiteSpace() or siblings[index + 1].isComment())):
             index += 1
@@ -619,7 +977,7 @@ class CSSToken(object):
             return None
 
         siblings = self.parent.children
-        i = siblings.index(self) + 1
+        i = self.ownIndex() + 1
         while i < len(siblings):
             if not ignoreWhiteSpace or not (siblings[i].isWhiteSpace() or siblings[i].isComment()):
                 return siblings[i]
@@ -632,7 +990,7 @@ class CSSToken(object):
             return None
 
         siblings = self.parent.children
-        i = siblings.index(self) - 1
+        i = self.ownIndex() - 1
         while i >= 0:
             if not ignoreWhiteSpace or not (siblings[i].isWhiteSpace() or siblings[i].isComment()):
                 return siblings[i]
@@ -652,11 +1010,44 @@ class CSSToken(object):
             token = token.parent
         return token
 
+    # returns the index of the token in its parent's list of children
+    #
+    # every token remembers its index as a hint, which is only trusted after
+    # verifying it. if the hint turns out to be outdated, the parent renumbers
+    # its children, but only those after the ones it knows to be numbered
+    # correctly, keeping the cost amortized constant when tokens are inserted
+    # or removed while walking through the children
     def ownIndex(self):
         if self.parent == None:
             raise CSSParseError("Cannot determine own index of token without parent", self)
 
-        return self.parent.children.index(self)
+        siblings = self.parent.children
+        index = self.indexHint
+        if index < len(siblings) and siblings[index] is self:
+            return index
+        return self.parent.indexChild(self)
+
+    # renumbers the index hints of the children up to the given child, returns
+    # the index of the child
+    def indexChild(self, token):
+        children = self.children
+        index = self.numIndexedChildren
+        if index > len(children):
+            index = 0
+        while index < len(children):
+            child = children[index]
+            child.indexHint = index
+            index += 1
+            if child is token:
+                self.numIndexedChildren = index
+                return index - 1
+
+        # the children have been replaced without us knowing, so renumber them
+        # all from scratch
+        for index in range(0, len(children)):
+            children[index].indexHint = index
+        self.numIndexedChildren = len(children)
+        return children.index(token)
 
     # return a clone (copy) of itself
     def clone(self):
@@ -666,11 +1057,26 @@ class CSSToken(object):
             if child.isComment():
                 continue
             drone = child.clone()
+            drone.indexHint = len(drones)
             clone.adopt(drone)
             drones.append(drone)
         clone.children = drones
+        clone.numIndexedChildren = len(drones)
         return clone
 
+    # returns an exact copy of the token and all its children, unlike clone()
+    # this keeps comments, whitespace and resolved variables intact
+    def duplicate(self):
+        duplicate = copy.copy(self)
+        duplicate.children = []
+        for child in self.children:
+            child = child.duplicate()
+            child.indexHint = len(duplicate.children)
+            duplicate.adopt(child)
+            duplicate.children.append(child)
+        duplicate.numIndexedChildren = len(duplicate.children)
+        return duplicate
+
     def performRuleSetVersusDeclarationLookAhead(self, stream):
         # perform some look-ahead processing to distinguish between
         # SCSS nested rules and regular declarations
@@ -694,20 +1100,33 @@ class CSSToken(object):
 
     # writes all tokens back to a string
     def toString(self, options = CSSOptions()):
-        string = ""
+        output = []
+        self.serialize(output, options)
+        return "".join(output)
+
+    # appends the string representation of the token to an output list, which
+    # is passed down the whole tree so that the string is only joined once
+    def serialize(self, output, options = CSSOptions()):
         if len(self.children) > 0:
             for token in self.children:
-                string += token.toString(options)
+                token.serialize(output, options)
         else:
-            string += self.data
-        return string
+            output.append(self.data)
+
+    # writes the string representation of the token to a file-like object
+    def write(self, sink, options = CSSOptions()):
+        sink.write(self.toString(options))
 
 
 class CSSStyleSheetToken(CSSToken):
+    __slots__ = ("path", "ruleSets", "extends", "selectorIndex")
+
     def __init__(self):
-        CSSToken.__init__(self, [CSSAtRuleToken, CSSRuleSetToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSAssignmentToken], None)
+        CSSToken.__init__(self, None)
         self.path = "."
         self.ruleSets = []
+        self.extends = []
+        self.selectorIndex = None
 
     def setPath(self, path):
         self.path = path
@@ -726,28 +1145,76 @@ class CSSStyleSheetToken(CSSToken):
         CSSToken.adopt(self, token)
         if isinstance(token, CSSRuleSetToken):
             self.ruleSets.append(token)
+            if self.selectorIndex != None:
+                self.indexRuleSet(token)
 
     def reject(self, token):
         CSSToken.reject(self, token)
         if isinstance(token, CSSRuleSetToken):
             self.ruleSets.remove(token)
+            self.selectorIndex = None
 
     def getRuleSets(self):
         return self.ruleSets
 
-    def toString(self, options = CSSOptions()):
-        string = ""
+    # remembers an @extend of the given selector by the given rule set, all
+    # extends are processed at once after the style sheet is compiled
+    def addExtend(self, ruleSet, selector):
+        self.extends.append((ruleSet, selector))
+
+    def takeExtends(self):
+        extends = self.extends
+        self.extends = []
+        return extends
+
+    # returns the rule sets by the normalized sub-selectors they have, rule
+    # sets that are added later are indexed as well, but whoever changes the
+    # selector of an indexed rule set has to call indexRuleSet() again
+    def getSelectorIndex(self):
+        if self.selectorIndex == None:
+            self.selectorIndex = {}
+            for ruleSet in self.ruleSets:
+                self.indexRuleSet(ruleSet)
+        return self.selectorIndex
+
+    def indexRuleSet(self, ruleSet):
+        for subSelector in ruleSet.getSelector().getSubSelectors():
+            ruleSets = self.selectorIndex.setdefault(selectorKey(subSelector), [])
+            if ruleSet not in ruleSets:
+                ruleSets.append(ruleSet)
+
+    def dropSelectorIndex(self):
+        self.selectorIndex = None
+
+    def isWhiteSpaceSignificant(self):
+        return False
+
+    def serialize(self, output, options = CSSOptions()):
+        for token in self.children:
+            if options.stripWhiteSpace and token.isWhiteSpace():
+                continue
+            token.serialize(output, options)
+
+    # writes the style sheet to a file-like object, every top-level token is
+    # written as soon as it is serialized so that the output as a whole never
+    # needs to be kept in memory
+    def write(self, sink, options = CSSOptions()):
+        output = []
         for token in self.children:
             if options.stripWhiteSpace and token.isWhiteSpace():
                 continue
-            string += token.toString(options)
-        return string
+            token.serialize(output, options)
+            sink.write("".join(output))
+            del output[:]
 
 
 class CSSAtRuleToken(CSSToken):
+    __slots__ = ("block", "program")
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [CSSAtRuleToken, CSSAtKeywordToken, CSSWhiteSpaceToken, CSSAnyToken, CSSBlockToken, CSSCommentToken, SCSSVariableToken], parent)
+        CSSToken.__init__(self, parent)
         self.block = None
+        self.program = None # the compiled expression, see scssprogram
 
     def process(self, stream, options = CSSOptions()):
         if self.block != None:
@@ -809,33 +1276,35 @@ class CSSAtRuleToken(CSSToken):
     def getBlock(self):
         return self.block
 
-    def toString(self, options = CSSOptions()):
-        string = ""
+    def serialize(self, output, options = CSSOptions()):
         for token in self.children:
             if options.stripWhiteSpace and token.isWhiteSpace():
                if (token.isFirstChild(True) or token.isLastChild(True) or
                    token.getNextSibling(True).isBoundary() or
                    token.getPreviousSibling(True).isBoundary()):
                     continue
-            string += token.toString(options)
-        return string
+            token.serialize(output, options)
 
 
 class CSSAtKeywordToken(CSSToken):
+    __slots__ = ()
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [], parent)
+        CSSToken.__init__(self, parent)
 
     def process(self, stream, options = CSSOptions()):
         self.consume(stream.takeAtKeyword())
         return self.parent
 
-    def toString(self, options = CSSOptions()):
-        return colorize(self.data, "00;32") if options.colorize else self.data
+    def serialize(self, output, options = CSSOptions()):
+        output.append(colorize(self.data, "00;32") if options.colorize else self.data)
 
 
 class CSSBlockToken(CSSToken):
+    __slots__ = ()
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [CSSAnyToken, CSSBlockToken, CSSAtRuleToken, CSSRuleSetToken, CSSDeclarationToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSAssignmentToken], parent)
+        CSSToken.__init__(self, parent)
 
     def process(self, stream, options = CSSOptions()):
         token = CSSToken.process(self, stream, options)
@@ -870,8 +1339,7 @@ class CSSBlockToken(CSSToken):
 
         return self.createChild(CSSAnyToken)
 
-    def toString(self, options = CSSOptions()):
-        string = ""
+    def serialize(self, output, options = CSSOptions()):
         for token in self.children:
             if options.stripWhiteSpace and token.isWhiteSpace():
                 if (token.isFirstChild() or token.isLastChild() or
@@ -881,13 +1349,14 @@ class CSSBlockToken(CSSToken):
             if options.stripExtraSemicolons and token.isDelimiter(";"):
                 if token.getNextSibling(ignoreWhiteSpace = True).isDelimiter():
                     continue
-            string += token.toString(options)
-        return string
+            token.serialize(output, options)
 
 
 class CSSRuleSetToken(CSSToken):
+    __slots__ = ("selector", "isOpened")
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [CSSAtRuleToken, CSSRuleSetToken, CSSSelectorToken, CSSDeclarationToken, CSSDelimiterToken, SCSSAssignmentToken, CSSWhiteSpaceToken, CSSCommentToken], parent)
+        CSSToken.__init__(self, parent)
         self.selector = None
         self.isOpened = False
 
@@ -956,24 +1425,32 @@ class CSSRuleSetToken(CSSToken):
                 declarations.append(token)
         return declarations
 
-    def toString(self, options = CSSOptions()):
+    def isWhiteSpaceSignificant(self):
+        return False
+
+    def serialize(self, output, options = CSSOptions()):
         if options.minimizeValues and len(self.getDeclarations()) == 0:
-            return ""
+            return
 
-        string = ""
         for token in self.children:
             if options.stripWhiteSpace and token.isWhiteSpace():
                 continue
             if options.stripExtraSemicolons and token.isDelimiter(";"):
                 if token.getNextSibling(ignoreWhiteSpace = True).isDelimiter():
                     continue
-            string += token.toString(options)
-        return string
+            token.serialize(output, options)
 
 
+# while compiling, selectors are combined and extended over and over again, for
+# which they are kept as tuples of "atoms" rather than as children. the atoms are
+# the tokens of the selector, which are shared between all selectors built from
+# them rather than cloned, and are only serialized when the selector is
 class CSSSelectorToken(CSSToken):
+    __slots__ = ("atoms",)
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [CSSAnyToken, CSSWhiteSpaceToken, CSSCommentToken], parent)
+        CSSToken.__init__(self, parent)
+        self.atoms = None
 
     def process(self, stream, options = CSSOptions()):
         token = CSSToken.process(self, stream, options)
@@ -985,32 +1462,47 @@ class CSSSelectorToken(CSSToken):
 
         return self.createChild(CSSAnyToken)
 
-    def getAmpersand(self):
-        for token in self.children:
-            if token.isDelimiter("&"):
-                return token
-        return None
+    # returns the tokens of the selector as a tuple of atoms
+    def getAtoms(self):
+        if self.atoms != None:
+            return self.atoms
+        return tuple(self.children)
+
+    # returns the atoms of the selector the way clone() would copy them, so they
+    # can be shared with other selectors
+    def getSharedAtoms(self):
+        atoms = []
+        for atom in self.getAtoms():
+            if atom.isWhiteSpace():
+                atoms.append(SELECTOR_SPACE)
+            elif self.atoms == None and len(atom.children) > 0:
+                atoms.append(atom.clone())
+            else:
+                atoms.append(atom)
+        return tuple(atoms)
 
-    # returns all comma-separated sub-selectors (each selector has been stripped
-    # of leading and trailing whitespace)
+    # replaces the selector with the given atoms, which are not adopted
+    def setAtoms(self, atoms):
+        self.atoms = tuple(atoms)
+        self.children = []
+        self.numIndexedChildren = 0
+
+    # returns all comma-separated sub-selectors as tuples of atoms (each
+    # selector has been stripped of leading and trailing whitespace)
     def getSubSelectors(self):
+        atoms = self.getSharedAtoms()
         subSelectors = []
-        subSelector = []
-        for token in self.children:
-            if len(subSelector) == 0 and token.isWhiteSpace():
-                continue
-            if token.isDelimiter(","):
-                if len(subSelector) > 0:
-                    while subSelector[-1].isWhiteSpace():
-                        subSelector = subSelector[0:-1]
-                    subSelectors.append(subSelector)
-                    subSelector = []
-            else:
-                subSelector.append(token)
-        if len(subSelector) > 0:
-            while subSelector[-1].isWhiteSpace():
-                subSelector = subSelector[0:-1]
-            subSelectors.append(subSelector)
+        start = 0
+        for i in range(0, len(atoms) + 1):
+            if i == len(atoms) or atoms[i].isDelimiter(","):
+                end = i
+                while start < end and atoms[start].isWhiteSpace():
+                    start += 1
+                while end > start and atoms[end - 1].isWhiteSpace():
+                    end -= 1
+                if end > start:
+                    subSelectors.append(atoms[start:end])
+                start = i + 1
         return subSelectors
 
     # returns all children with the exception of leading and trailing whitespace 
@@ -1026,17 +1518,33 @@ class CSSSelectorToken(CSSToken):
             children.append(child)
         return children
 
-    def toString(self, options = CSSOptions()):
-        string = ""
-        for token in self.children:
-            if options.stripWhiteSpace and token.isWhiteSpace() and token.isLastChild():
-                continue
-            string += token.toString(CSSOptions(options, colorize = False))
-        return colorize(string, "00;36") if options.colorize else string
+    # whitespace around combinators and commas is kept in the output
+    def isWhiteSpaceSignificant(self):
+        return len(self.children) > 0 and not self.children[-1].isWhiteSpace()
+
+    def serialize(self, output, options = CSSOptions()):
+        if options.colorize:
+            startColor(output, "00;36")
+        childOptions = CSSOptions(options, colorize = False)
+        if self.atoms != None:
+            for i in range(0, len(self.atoms)):
+                atom = self.atoms[i]
+                if options.stripWhiteSpace and atom.isWhiteSpace() and i == len(self.atoms) - 1:
+                    continue
+                atom.serialize(output, childOptions)
+        else:
+            for token in self.children:
+                if options.stripWhiteSpace and token.isWhiteSpace() and token.isLastChild():
+                    continue
+                token.serialize(output, childOptions)
+        if options.colorize:
+            endColor(output)
 
 class CSSDeclarationToken(CSSToken):
+    __slots__ = ("property", "value", "hasColon")
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [CSSPropertyToken, CSSValueToken, CSSDelimiterToken, CSSWhiteSpaceToken, CSSCommentToken], parent)
+        CSSToken.__init__(self, parent)
         self.property = None
         self.hasColon = False
         self.value = None
@@ -1085,19 +1593,26 @@ class CSSDeclarationToken(CSSToken):
 
         return self.value
 
-    def toString(self, options = CSSOptions()):
+    def isWhiteSpaceSignificant(self):
+        return False
+
+    def serialize(self, output, options = CSSOptions()):
         if options.stripWhiteSpace:
-            return self.property.toString(options) + ":" + self.value.toString(options)
-        string = ""
+            self.property.serialize(output, options)
+            output.append(":")
+            self.value.serialize(output, options)
+            return
         for token in self.children:
-            string += token.toString(options)
-        return string
+            token.serialize(output, options)
 
 
 class CSSValueToken(CSSToken):
+    __slots__ = ("block", "program")
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [CSSAnyToken, CSSBlockToken, CSSAtKeywordToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSVariableToken], parent)
+        CSSToken.__init__(self, parent)
         self.block = None
+        self.program = None # the compiled expression, see scssprogram
 
     def process(self, stream, options = CSSOptions()):
         token = CSSToken.process(self, stream, options)
@@ -1143,8 +1658,7 @@ class CSSValueToken(CSSToken):
         if self.block == token:
             self.block = None
 
-    def toString(self, options = CSSOptions()):
-        string = ""
+    def serialize(self, output, options = CSSOptions()):
         children = self.getStrippedChildren() if options.stripWhiteSpace else self.children
         for token in children:
             # these minimizations are only valid in the context of a value token
@@ -1152,7 +1666,7 @@ class CSSValueToken(CSSToken):
                 if token.type == CSS_IDENT_VALUE or token.type == CSS_HASH_VALUE:
                     try: # try to see whether it's a color and minify if it is
                         color = minimizeColorValue(token)
-                        string += colorize(color, "01;34") if options.colorize else color
+                        output.append(colorize(color, "01;34") if options.colorize else color)
                         continue
                     except Exception, exception:
                         pass
@@ -1160,16 +1674,17 @@ class CSSValueToken(CSSToken):
                 if token.type == CSS_IDENT_VALUE and token.data == "none":
                     property = self.parent.getProperty().data
                     if property in ["border", "border-top", "border-right", "border-bottom", "border-left", "outline", "background"]:
-                        string += colorize("0", "01;34") if options.colorize else "0";
+                        output.append(colorize("0", "01;34") if options.colorize else "0");
                         continue;
 
-            string += token.toString(options)
-        return string
+            token.serialize(output, options)
 
 
 class CSSAnyToken(CSSToken):
+    __slots__ = ("type",)
+
     def __init__(self, parent, type = CSS_UNKNOWN_VALUE, data = None):
-        CSSToken.__init__(self, [CSSAnyToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSVariableToken], parent)
+        CSSToken.__init__(self, parent)
         self.type = type
         if data:
             self.consume(data)
@@ -1334,22 +1849,33 @@ class CSSAnyToken(CSSToken):
 
         raise CSSParseError("Cannot convert this type of token to a float", token = self)
 
-    def toString(self, options = CSSOptions()):
+    # calc() expressions keep all their whitespace
+    def isWhiteSpaceSignificant(self):
+        return len(self.children) > 0 and not self.children[-1].isWhiteSpace()
+
+    def serialize(self, output, options = CSSOptions()):
         if len(self.children) > 0:
-            string = ""
+            colorized = options.colorize and not self.isDelimiter()
             if (options.minimizeValues and self.type == CSS_FUNCTION_VALUE and
                 self.getName() in ["rgb", "rgba", "hsl", "hsla"]):
-                string = minimizeColorValue(self)
-            elif self.type == CSS_FUNCTION_VALUE and re.match("(-[a-z]+-)?calc", self.getName()):
+                color = minimizeColorValue(self)
+                output.append(colorize(color, "01;36") if colorized else color)
+                return
+
+            if colorized:
+                startColor(output, "01;36")
+            if self.type == CSS_FUNCTION_VALUE and re.match("(-[a-z]+-)?calc", self.getName()):
                 for token in self.children:
-                    string += token.toString(options)
+                    token.serialize(output, options)
             else:
                 for token in self.children:
                     if options.stripWhiteSpace and token.isWhiteSpace():
                         if (token.getNextSibling().isBoundary() or
                             token.getPreviousSibling().isBoundary()):
                             continue
-                    string += token.toString(options)
+                    token.serialize(output, options)
+            if colorized:
+                endColor(output)
         else:
             data = self.data
             if self.type == CSS_URI_VALUE and options.stripWhiteSpace:
@@ -1364,17 +1890,20 @@ class CSSAnyToken(CSSToken):
                         pass # okay, we just stripped off leading zeros
                     else:
                         data = "0" # a measurement was following, leave it out...
-            string = data
-        return colorize(string, "01;36") if options.colorize and not self.isDelimiter() else string
+            output.append(colorize(data, "01;36") if options.colorize and not self.isDelimiter() else data)
 
 
 # just a convenience for creating new identifiers
 class CSSIdentifierToken(CSSAnyToken):
+    __slots__ = ()
+
     def __init__(self, parent, identifier = ""):
         CSSAnyToken.__init__(self, parent, CSS_IDENT_VALUE, identifier)
 
 
 class CSSPropertyToken(CSSIdentifierToken):
+    __slots__ = ()
+
     def __init__(self, parent, property = ""):
         CSSIdentifierToken.__init__(self, parent, property)
 
@@ -1382,17 +1911,21 @@ class CSSPropertyToken(CSSIdentifierToken):
         self.consume(stream.takeIdentifier())
         return self.parent
 
-    def toString(self, options = CSSOptions()):
-        return colorize(self.data, "00;35") if options.colorize else self.data
+    def serialize(self, output, options = CSSOptions()):
+        output.append(colorize(self.data, "00;35") if options.colorize else self.data)
 
 
 # just a convenience for creating new strings
 class CSSStringToken(CSSAnyToken):
+    __slots__ = ()
+
     def __init__(self, parent, string):
         CSSAnyToken.__init__(self, parent, CSS_STRING_VALUE, string)
 
 
 class CSSDelimiterToken(CSSAnyToken):
+    __slots__ = ()
+
     def __init__(self, parent, delimiter = ""):
         CSSAnyToken.__init__(self, parent, CSS_DELIM_VALUE, delimiter)
 
@@ -1401,8 +1934,10 @@ class CSSDelimiterToken(CSSAnyToken):
 
 
 class SCSSVariableToken(CSSAnyToken):
+    __slots__ = ("variable",)
+
     def __init__(self, parent, variable = None):
-        CSSToken.__init__(self, [], parent)
+        CSSToken.__init__(self, parent)
         self.type = SCSS_VARIABLE_VALUE
         self.variable = variable
 
@@ -1422,12 +1957,12 @@ class SCSSVariableToken(CSSAnyToken):
             raise CSSParseError("Can only assign SCSS variables to variable tokens", token = self)
         self.variable = variable
 
-    def toString(self, options = CSSOptions()):
+    def serialize(self, output, options = CSSOptions()):
         if self.variable != None:
             string = self.variable.toString(options)
         else:
             string = self.data
-        return colorize(string, "01;34") if options.colorize else string
+        output.append(colorize(string, "01;34") if options.colorize else string)
 
     def clone(self):
         clone = copy.copy(self)
@@ -1436,8 +1971,10 @@ class SCSSVariableToken(CSSAnyToken):
 
 
 class SCSSAssignmentToken(CSSToken):
+    __slots__ = ("variable", "value", "hasColon")
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [SCSSVariableToken, CSSValueToken, CSSDelimiterToken, CSSWhiteSpaceToken, CSSCommentToken], parent)
+        CSSToken.__init__(self, parent)
         self.variable = None
         self.hasColon = False
         self.value = None
@@ -1479,8 +2016,11 @@ class SCSSAssignmentToken(CSSToken):
 
         return self.value
 
-    def toString(self, options = CSSOptions()):
-        return "" # SCSS assignments should never end up in the CSS output
+    def isWhiteSpaceSignificant(self):
+        return False
+
+    def serialize(self, output, options = CSSOptions()):
+        pass # SCSS assignments should never end up in the CSS output
 
     def adopt(self, token):
         CSSToken.adopt(self, token)
@@ -1489,26 +2029,20 @@ class SCSSAssignmentToken(CSSToken):
 
 
 class CSSCommentToken(CSSToken):
+    __slots__ = ("singleLineComment",)
+
     def __init__(self, parent):
-        CSSToken.__init__(self, [], parent)
+        CSSToken.__init__(self, parent)
         self.singleLineComment = False
 
     def process(self, stream, options = CSSOptions()):
         if len(self.data) == 2 and self.data[1] == "/":
             self.singleLineComment = True
 
-        if self.singleLineComment:
-            while not (stream.isEndOfFile() or stream.isNewline()):
-                self.consume(stream.take())
-        else:
-            while not (stream.isEndOfFile() or stream.isCommentEnd()):
-                self.consume(stream.take())
-            if stream.isCommentEnd():
-                self.consume(stream.take(2))
-
+        self.consume(stream.takeCommentBody(self.singleLineComment))
         return self.parent
 
-    def toString(self, options = CSSOptions()):
+    def serialize(self, output, options = CSSOptions()):
         stripComment = options.stripComments
         if self.singleLineComment:
             stripComment = True
@@ -1516,26 +2050,50 @@ class CSSCommentToken(CSSToken):
             stripComment = False
 
         if stripComment:
-            return ""
+            return
 
         if self.singleLineComment:
             comment = "/*" + self.data[2:] + "*/"
         else:
             comment = self.data
-        return colorize(comment, "00;32") if options.colorize else comment
+        output.append(colorize(comment, "00;32") if options.colorize else comment)
 
 
 class CSSWhiteSpaceToken(CSSToken):
+    __slots__ = ()
+
     def __init__(self, parent, data = ""):
-        CSSToken.__init__(self, [], parent)
+        CSSToken.__init__(self, parent)
         self.data = data
 
     def process(self, stream, options = CSSOptions()):
         self.consume(stream.takeWhiteSpace())
         return self.parent
 
-    def toString(self, options = CSSOptions()):
-        return " " if options.stripWhiteSpace else self.data 
+    def serialize(self, output, options = CSSOptions()):
+        output.append(" " if options.stripWhiteSpace else self.data)
 
     def clone(self):
         return CSSWhiteSpaceToken(self.parent, " ")
+
+
+# atoms shared by all selectors that are combined from others
+SELECTOR_COMMA = CSSDelimiterToken(None, ",")
+SELECTOR_SPACE = CSSWhiteSpaceToken(None, " ")
+
+
+# the types of tokens every type of token accepts as its children
+CSSToken.allowedChildren = ()
+CSSStyleSheetToken.allowedChildren = (CSSAtRuleToken, CSSRuleSetToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSAssignmentToken)
+CSSAtRuleToken.allowedChildren = (CSSAtRuleToken, CSSAtKeywordToken, CSSWhiteSpaceToken, CSSAnyToken, CSSBlockToken, CSSCommentToken, SCSSVariableToken)
+CSSAtKeywordToken.allowedChildren = ()
+CSSBlockToken.allowedChildren = (CSSAnyToken, CSSBlockToken, CSSAtRuleToken, CSSRuleSetToken, CSSDeclarationToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSAssignmentToken)
+CSSRuleSetToken.allowedChildren = (CSSAtRuleToken, CSSRuleSetToken, CSSSelectorToken, CSSDeclarationToken, CSSDelimiterToken, SCSSAssignmentToken, CSSWhiteSpaceToken, CSSCommentToken)
+CSSSelectorToken.allowedChildren = (CSSAnyToken, CSSWhiteSpaceToken, CSSCommentToken)
+CSSDeclarationToken.allowedChildren = (CSSPropertyToken, CSSValueToken, CSSDelimiterToken, CSSWhiteSpaceToken, CSSCommentToken)
+CSSValueToken.allowedChildren = (CSSAnyToken, CSSBlockToken, CSSAtKeywordToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSVariableToken)
+CSSAnyToken.allowedChildren = (CSSAnyToken, CSSWhiteSpaceToken, CSSCommentToken, SCSSVariableToken)
+SCSSVariableToken.allowedChildren = ()
+SCSSAssignmentToken.allowedChildren = (SCSSVariableToken, CSSValueToken, CSSDelimiterToken, CSSWhiteSpaceToken, CSSCommentToken)
+CSSCommentToken.allowedChildren = ()
+CSSWhiteSpaceToken.allowedChildren = ()
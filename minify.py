@@ -3,6 +3,7 @@
 import optparse
 import sys
 
+import cssoptimizer
 import cssparser
 
 
@@ -12,11 +13,28 @@ if __name__ == "__main__":
     optionParser = optparse.OptionParser(usage = usage)
     optionParser.add_option("", "--color", action = "store_true",
                       help = "Colorize the output")
-    (options, args) = optionParser.parse_args()
+    optionParser.add_option("-O", "--optimize", type = "int", default = 0, metavar = "LEVEL",
+                      help = "Restructure the output to make it smaller. Level 1 merges rule sets with "
+                             "the same selector or the same declarations, level 2 also removes "
+                             "overridden declarations and collapses longhands into shorthands.")
+    optionParser.add_option("-o", "--output",
+                      help = "Write the output to a file instead of stdout.")
+    (o, args) = optionParser.parse_args()
 
     parser = cssparser.CSSParser()
     options = cssparser.CSSOptions(stripWhiteSpace = True, stripComments = True, minimizeValues = True,
-                                   stripExtraSemicolons = True, colorize = options.color, compileScss = True)
+                                   stripExtraSemicolons = True, colorize = o.color, compileScss = True,
+                                   optimizeLevel = o.optimize)
     token = parser.parse(sys.stdin.read(), options)
-    print token.toString(options)
+
+    if options.optimizeLevel:
+        optimizer = cssoptimizer.CSSOptimizer(options.optimizeLevel)
+        optimizer.optimize(token)
+
+    if o.output:
+        import scssbatch
+        scssbatch.writeStyleSheet(token, o.output, options)
+    else:
+        token.write(sys.stdout, options)
+        sys.stdout.write("\n")
 
@@ -1,8 +1,11 @@
 #!/usr/bin/python
 
+from __future__ import with_statement
+
 import optparse
 import sys
 
+import cssoptimizer
 import cssparser
 import scsscompiler
 import scssconsole
@@ -10,34 +13,135 @@ import scssconsole
 
 if __name__ == "__main__":
 
-    usage = "Usage: stdin | %prog [options] | stdout"
+    usage = ("Usage: stdin | %prog [options] | stdout\n"
+             "       %prog [options] --batch input.scss:output.css|input.scss|directory ...\n"
+             "       %prog [options] --watch directory")
     optionParser = optparse.OptionParser(usage = usage)
+    optionParser.add_option("", "--batch", action = "store_true",
+                      help = "Compile all files given as arguments in a single run. With --output, "
+                             "the output is written to the given directory.")
+    optionParser.add_option("", "--cache-location",
+                      help = "Directory in which to cache parsed imports.")
     optionParser.add_option("", "--color", action = "store_true",
                       help = "Colorize the output")
+    optionParser.add_option("", "--function-cache", type = "int", metavar = "SIZE",
+                      help = "Cache the results of up to SIZE calls to functions without side effects.")
     optionParser.add_option("-i", "--interactive", action = "store_true",
                       help = "Run an interactive SassScript shell.")
+    optionParser.add_option("-j", "--jobs", type = "int", default = 1,
+                      help = "Number of processes to use in batch mode.")
     optionParser.add_option("-I", "--load-path",
                       help = "Add a sass import path.")
     optionParser.add_option("", "--minimize", action = "store_true",
                       help = "Minimize the output (--style compact in sass).")
+    optionParser.add_option("", "--mixin-cache", type = "int", metavar = "SIZE",
+                      help = "Cache the expansions of up to SIZE includes of mixins without side effects.")
+    optionParser.add_option("-O", "--optimize", type = "int", default = 0, metavar = "LEVEL",
+                      help = "Restructure the output to make it smaller. Level 1 merges rule sets with "
+                             "the same selector or the same declarations, level 2 also removes "
+                             "overridden declarations and collapses longhands into shorthands.")
+    optionParser.add_option("-o", "--output",
+                      help = "Write the output to a file instead of stdout.")
+    optionParser.add_option("", "--profile", action = "store_true",
+                      help = "Print a report of where the time is spent to stderr.")
+    optionParser.add_option("", "--profile-json", metavar = "FILE",
+                      help = "Write a report of where the time is spent to a JSON file.")
+    optionParser.add_option("", "--trace-folded", metavar = "FILE",
+                      help = "Write the time spent in every import, mixin and function call chain "
+                             "to a file, in the folded stack format used for flame graphs.")
+    optionParser.add_option("", "--watch",
+                      help = "Compile all files in a directory and recompile them whenever they "
+                             "or the files they import change. With --output, the output is "
+                             "written to the given directory.")
     (o, args) = optionParser.parse_args()
 
     options = cssparser.CSSOptions(stripWhiteSpace = o.minimize, stripComments = o.minimize,
                                    minimizeValues = o.minimize, stripExtraSemicolons = o.minimize,
-                                   colorize = o.color, compileScss = True)
+                                   colorize = o.color, compileScss = True, optimizeLevel = o.optimize)
 
     if o.load_path:
         import scssimporter
-        scssimporter.Importer.addPath(load_path)
+        scssimporter.Importer.addPath(o.load_path)
+
+    if o.cache_location:
+        import scsscache
+        import scssimporter
+        scssimporter.Importer.setParseCache(scsscache.SCSSParseCache(o.cache_location))
 
-    if o.interactive:
+    if o.function_cache:
+        import scsscache
+        import scssfunction
+        scssfunction.SCSSFunction.setCache(scsscache.SCSSFunctionCache(o.function_cache))
+
+    if o.mixin_cache:
+        import scsscache
+        import scssmixin
+        scssmixin.SCSSMixin.setCache(scsscache.SCSSMixinCache(o.mixin_cache))
+
+    if o.batch:
+        import scssbatch
+        batchCompiler = scssbatch.SCSSBatchCompiler()
+        for argument in args:
+            batchCompiler.addArgument(argument, o.output)
+        sys.exit(1 if batchCompiler.compile(options, numJobs = o.jobs) else 0)
+    elif o.watch:
+        import scsswatch
+        watcher = scsswatch.SCSSWatcher(o.watch, o.output, options)
+        watcher.watch()
+    elif o.interactive:
         console = scssconsole.SCSSConsole()
         console.start(options)
     else:
+        profiler = None
+        if o.profile or o.profile_json or o.trace_folded:
+            import scssprofiler
+            profiler = scssprofiler.SCSSProfiler()
+            profiler.enter("file", "stdin")
+            profiler.enter("phase", "parse")
+
         parser = cssparser.CSSParser()
         token = parser.parse(sys.stdin.read(), options)
-    
+
+        if profiler:
+            profiler.leave()
+
         compiler = scsscompiler.SCSSCompiler()
-        compiler.compile(token, options)
-    
-        print token.toString(options)
+        compiler.compile(token, options, profiler)
+
+        if options.optimizeLevel:
+            if profiler:
+                profiler.enter("phase", "optimize")
+            optimizer = cssoptimizer.CSSOptimizer(options.optimizeLevel)
+            optimizer.optimize(token)
+            if profiler:
+                profiler.leave()
+
+        if profiler:
+            profiler.enter("phase", "serialize")
+
+        if o.output:
+            import scssbatch
+            scssbatch.writeStyleSheet(token, o.output, options)
+        else:
+            token.write(sys.stdout, options)
+            sys.stdout.write("\n")
+
+        if profiler:
+            profiler.leave()
+            profiler.leave()
+            if o.profile:
+                sys.stderr.write(profiler.report() + "\n")
+                if o.function_cache:
+                    import scssfunction
+                    cache = scssfunction.SCSSFunction.cache
+                    sys.stderr.write("function cache: %d hits, %d misses\n" % (cache.hits, cache.misses))
+                if o.mixin_cache:
+                    import scssmixin
+                    cache = scssmixin.SCSSMixin.cache
+                    sys.stderr.write("mixin cache: %d expansions saved, %d misses\n" % (cache.hits, cache.misses))
+            if o.profile_json:
+                with open(o.profile_json, "w") as f:
+                    f.write(profiler.toJson())
+            if o.trace_folded:
+                with open(o.trace_folded, "w") as f:
+                    f.write(profiler.toFoldedStacks() + "\n")
@@ -0,0 +1,206 @@
+from __future__ import with_statement
+
+import codecs
+import collections
+import itertools
+import multiprocessing
+import os
+import re
+import stat
+import sys
+import tempfile
+import time
+
+import cssoptimizer
+import cssparser
+import scsscache
+import scsscompiler
+import scssimporter
+
+
+IMPORT_PATTERN = re.compile(r"@import\s+([^;{}]+)")
+IMPORT_NAME_PATTERN = re.compile(r"\"([^\"]*)\"|'([^']*)'")
+
+# the umask of the process, which can only be read by changing it, so this is
+# done once on startup rather than while other processes may create files
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+class SCSSBatchCompiler(object):
+    def __init__(self):
+        self.entries = []
+
+    def addFile(self, inputPath, outputPath):
+        self.entries.append((inputPath, outputPath))
+
+    # adds all SCSS files in the given directory, except partials, which are
+    # compiled to CSS files with the same name in the output directory (or
+    # next to the input file if no output directory is given)
+    def addDirectory(self, directory, outputDirectory = None):
+        for fileName in sorted(os.listdir(directory)):
+            if fileName[0] == "_" or not fileName.endswith(".scss"):
+                continue
+            outputFileName = fileName[:-5] + ".css"
+            self.addFile(os.path.join(directory, fileName),
+                         os.path.join(outputDirectory or directory, outputFileName))
+
+    # adds an entry from the command line, which is either a directory or an
+    # input and output path separated by a colon
+    def addArgument(self, argument, outputDirectory = None):
+        if os.path.isdir(argument):
+            self.addDirectory(argument, outputDirectory)
+        elif ":" in argument:
+            (inputPath, outputPath) = argument.rsplit(":", 1)
+            self.addFile(inputPath, outputPath)
+        else:
+            outputPath = (argument[:-5] if argument.endswith(".scss") else argument) + ".css"
+            if outputDirectory:
+                outputPath = os.path.join(outputDirectory, os.path.basename(outputPath))
+            self.addFile(argument, outputPath)
+
+    # compiles all entries, reporting the time spent on every file to the log,
+    # returns the number of files that failed to compile
+    #
+    # if more than one job is requested, the entries are distributed over a
+    # pool of worker processes, but they are still reported in order
+    def compile(self, options, log = sys.stderr, numJobs = 1):
+        if not scssimporter.Importer.parseCache:
+            scssimporter.Importer.setParseCache(scsscache.SCSSParseCache())
+
+        numFailures = 0
+        totalStart = time.time()
+
+        pool = None
+        jobs = [(inputPath, outputPath, options) for (inputPath, outputPath) in self.entries]
+        if numJobs > 1 and len(jobs) > 1:
+            workerArguments = (options, scssimporter.Importer.paths,
+                               scssimporter.Importer.parseCache.location, self.findSharedImports())
+            pool = multiprocessing.Pool(min(numJobs, len(jobs)), initializeWorker, workerArguments)
+            results = pool.imap(compileJob, jobs)
+        else:
+            results = itertools.imap(compileJob, jobs)
+
+        for (inputPath, outputPath, elapsed, error) in results:
+            if error:
+                numFailures += 1
+                log.write("%9s     %s: %s\n" % ("FAILED", inputPath, error))
+            else:
+                log.write("%9.1f ms  %s -> %s\n" % (elapsed * 1000, inputPath, outputPath))
+
+        if pool:
+            pool.close()
+            pool.join()
+
+        log.write("%9.1f ms  total (%d files, %d failed)\n" %
+                  ((time.time() - totalStart) * 1000, len(self.entries), numFailures))
+        return numFailures
+
+    # returns the paths of all files imported by more than one entry, together
+    # with all the files those import themselves
+    def findSharedImports(self):
+        numImports = {}
+        for (inputPath, outputPath) in self.entries:
+            for path in set(findImports(inputPath)):
+                numImports[path] = numImports.get(path, 0) + 1
+
+        sharedImports = [] # in the order they were found
+        visited = set()
+        pending = collections.deque(sorted([path for (path, count) in numImports.items() if count > 1]))
+        while pending:
+            path = pending.popleft()
+            if path not in visited:
+                visited.add(path)
+                sharedImports.append(path)
+                pending.extend(findImports(path))
+        return sharedImports
+
+# returns the paths of the SCSS files imported by the file at the given path
+def findImports(path):
+    try:
+        with codecs.open(path, "r") as f:
+            css = f.read()
+    except (IOError, OSError):
+        return [] # the error is reported when the file is compiled
+
+    paths = []
+    directory = os.path.dirname(path) or "."
+    for importMatch in IMPORT_PATTERN.finditer(css):
+        for nameMatch in IMPORT_NAME_PATTERN.finditer(importMatch.group(1)):
+            fileName = nameMatch.group(1) or nameMatch.group(2)
+            if not fileName or fileName.startswith("http://") or fileName.endswith(".css"):
+                continue
+            (importPath, isPartial) = scssimporter.Importer.findImport(fileName, directory)
+            if importPath:
+                paths.append(importPath)
+    return paths
+
+# prepares a worker process, by registering the builtin functions and parsing
+# the files that are likely to be imported by multiple entries up front
+def initializeWorker(options, paths, cacheLocation, sharedImports):
+    scssimporter.Importer.paths = paths
+    scssimporter.Importer.setParseCache(scsscache.SCSSParseCache(cacheLocation))
+
+    scsscompiler.SCSSCompiler()
+    for path in sharedImports:
+        try:
+            scssimporter.Importer.parseFile(path, options)
+        except Exception:
+            pass # the error is reported when an entry imports the file
+
+def compileJob(job):
+    (inputPath, outputPath, options) = job
+    start = time.time()
+    try:
+        compileFile(inputPath, outputPath, options)
+        error = None
+    except Exception, exception:
+        error = str(exception)
+    return (inputPath, outputPath, time.time() - start, error)
+
+def compileFile(inputPath, outputPath, options):
+    # compiling modifies the options, so every file gets its own copy
+    options = cssparser.CSSOptions(options)
+
+    scssimporter.Importer.reset()
+
+    with codecs.open(inputPath, "r") as f:
+        css = f.read()
+
+    parser = cssparser.CSSParser()
+    styleSheet = parser.parse(css, options)
+    styleSheet.setPath(os.path.dirname(inputPath) or ".")
+
+    compiler = scsscompiler.SCSSCompiler()
+    compiler.compile(styleSheet, options)
+
+    if options.optimizeLevel:
+        optimizer = cssoptimizer.CSSOptimizer(options.optimizeLevel)
+        optimizer.optimize(styleSheet)
+
+    outputDirectory = os.path.dirname(outputPath)
+    if outputDirectory and not os.path.isdir(outputDirectory):
+        os.makedirs(outputDirectory)
+
+    writeStyleSheet(styleSheet, outputPath, options)
+
+# writes the style sheet, followed by a newline, to the file at the given path.
+# the output goes to a temporary file first, which is renamed once it's
+# complete, so a failure never leaves a truncated file behind
+def writeStyleSheet(styleSheet, path, options):
+    (fd, tempPath) = tempfile.mkstemp(dir = os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as output:
+            # mkstemp only gives the owner access, so the file gets the mode of
+            # the file it replaces, or the mode of a newly created file
+            if os.path.exists(path):
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            else:
+                mode = 0666 & ~UMASK
+            os.fchmod(output.fileno(), mode)
+
+            styleSheet.write(output, options)
+            output.write("\n")
+        os.rename(tempPath, path)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
@@ -22,6 +22,9 @@ class SCSSBuiltinFunction(SCSSFunction):
         else:
             self.numArgs = numArgs
 
+    def isBuiltin(self):
+        return True
+
     def evaluate(self, callerScope, arguments = None):
         scope = SCSSScope()
         if arguments:
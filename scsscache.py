@@ -0,0 +1,169 @@
+from __future__ import with_statement
+
+import codecs
+import collections
+import copy
+import cPickle
+import hashlib
+import os
+import tempfile
+
+import cssparser
+
+
+# bump whenever the token classes change in a way that makes previously pickled
+# token trees incompatible
+CACHE_VERSION = 6
+
+class SCSSParseCache(object):
+    # if no location is given, parsed files are only cached in memory
+    def __init__(self, location = None):
+        self.location = location
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+        if location and not os.path.isdir(location):
+            os.makedirs(location)
+
+    # returns the parsed style sheet for the file at the given path, either
+    # loaded from the cache or freshly parsed (in which case it gets stored in
+    # the cache for the next time)
+    #
+    # every call returns a new token tree, so the caller is free to modify it
+    def parse(self, path, options):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cacheKey = (CACHE_VERSION, stat.st_mtime, stat.st_size, options.parsingFlags())
+        entryName = self.entryName(path, options)
+
+        data = None
+        if entryName in self.entries and self.entries[entryName][0] == cacheKey:
+            data = self.entries[entryName][1]
+        elif self.location:
+            data = self.load(entryName, cacheKey)
+
+        if data:
+            self.hits += 1
+            self.entries[entryName] = (cacheKey, data)
+            return cPickle.loads(data)
+
+        self.misses += 1
+        with codecs.open(path, "r") as f:
+            css = f.read()
+
+        parser = cssparser.CSSParser()
+        styleSheet = parser.parse(css, options)
+
+        try:
+            data = cPickle.dumps(styleSheet, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, RuntimeError):
+            return styleSheet # style sheets that cannot be pickled are not cached
+
+        self.entries[entryName] = (cacheKey, data)
+        if self.location:
+            self.store(entryName, cacheKey, data)
+        return styleSheet
+
+    def entryName(self, path, options):
+        return hashlib.sha1(repr((path, options.parsingFlags()))).hexdigest()
+
+    def load(self, entryName, cacheKey):
+        cachePath = os.path.join(self.location, entryName + ".pickle")
+        if not os.path.exists(cachePath):
+            return None
+
+        try:
+            with open(cachePath, "rb") as f:
+                (storedKey, data) = cPickle.load(f)
+        except Exception:
+            return None # a corrupt cache entry is treated as a miss
+
+        if storedKey != cacheKey:
+            return None
+        return data
+
+    # the entry is written to a temporary file first and then renamed, so that
+    # concurrent builds never see a partially written entry
+    def store(self, entryName, cacheKey, data):
+        tempPath = None
+        try:
+            (fd, tempPath) = tempfile.mkstemp(dir = self.location)
+            with os.fdopen(fd, "wb") as f:
+                cPickle.dump((cacheKey, data), f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tempPath, os.path.join(self.location, entryName + ".pickle"))
+        except (IOError, OSError, cPickle.PicklingError, RuntimeError):
+            # failing to write the cache is not fatal, we just reparse next time
+            if tempPath and os.path.exists(tempPath):
+                try:
+                    os.remove(tempPath)
+                except OSError:
+                    pass
+
+
+# caches results of calls, keeping at most the given number of results, evicting
+# the least recently used ones first.
+#
+# subclasses define copyResult(), which returns a copy of the given result that
+# can't be affected by changes to the original, or None if it can't be copied
+class SCSSResultCache(object):
+    def __init__(self, maxSize = 1000):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # returns a copy of the cached result for the given key, or None if
+    # there is none
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return self.copyResult(value)
+
+    # stores a copy of the result for the given key, unless it can't be copied
+    def add(self, key, value):
+        value = self.copyResult(value)
+        if value is None:
+            return
+
+        self.entries[key] = value
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
+
+
+# caches the results of function calls, results that are not plain values
+# (numbers, strings, colors, booleans, or lists of them) are not cached, as
+# their tokens may be modified by the caller
+class SCSSFunctionCache(SCSSResultCache):
+    def copyResult(self, value):
+        return copyValue(value)
+
+
+# caches the tokens mixins expand to, every hit saves a complete expansion
+class SCSSMixinCache(SCSSResultCache):
+    def copyResult(self, tokens):
+        return [token.duplicate() for token in tokens]
+
+
+# returns a copy of the given value, or None if it's not a plain value
+def copyValue(value):
+    if value is None:
+        return None
+    if value.isList():
+        items = []
+        for item in value.items:
+            item = copyValue(item)
+            if item is None:
+                return None
+            items.append(item)
+        value = copy.copy(value)
+        value.items = items
+        return value
+    if value.isNumber() or value.isString() or value.isColor() or value.isBoolean():
+        return copy.copy(value)
+    return None
@@ -6,10 +6,12 @@ import scssexpression
 import scssfunction
 import scssimporter
 import scssmixin
-import scssvariables
+import scssprofiler
 
 from scssexceptions import *
 from scssexpression import SCSSExpression
+from scssloop import SCSSLoop
+from scssprogram import SCSSProgram
 from scssscope import SCSSScope
 
 
@@ -21,6 +23,7 @@ class SCSSCompiler(object):
 
     def setGlobalScope(self, scope):
         self.scopes = [scope]
+        self.numCompiledTokens = 0
 
     def getGlobalScope(self):
         return self.scopes[0]
@@ -39,7 +42,20 @@ class SCSSCompiler(object):
     def getCurrentScope(self):
         return self.scopes[-1]
 
-    def compile(self, token, options = cssparser.CSSOptions()):
+    # compiles the token and its children, if a profiler is given, the time
+    # spent on compiling is recorded by it
+    def compile(self, token, options = cssparser.CSSOptions(), profiler = None):
+        if profiler:
+            previousProfiler = scssprofiler.ActiveProfiler
+            scssprofiler.ActiveProfiler = profiler
+            profiler.enter("phase", "compile")
+            try:
+                self.compile(token, options)
+            finally:
+                profiler.leave()
+                scssprofiler.ActiveProfiler = previousProfiler
+            return
+
         if token.isRuleSet():
             self.pushScope()
 
@@ -48,16 +64,11 @@ class SCSSCompiler(object):
             if token.parent == None: # the token could have been removed
                 return
 
-        i = 0
-        while i < len(token.children):
-            child = token.children[i]
-            if child.parent == None:
-                raise SCSSCompileError("Child is looking for its parents, please report at the tent next to the main stage", child)
-            self.compile(child, options)
-            if child.parent: # the token could have been removed
-                i += 1
+        self.compileChildren(token, 0, None, options)
 
-        if token.isAnyToken():
+        if token.isStyleSheet():
+            self.processExtends(token)
+        elif token.isAnyToken():
             self.compileAny(token)
         elif token.isValue():
             self.compileValue(token)
@@ -68,13 +79,49 @@ class SCSSCompiler(object):
         elif token.isRuleSet():
             self.compileRuleSet(token)
             self.popScope()
-        elif token.isAtRule() and token.getKeyWord() == "extend":
-            self.processExtend(token)
-        elif token.isAtRule() and token.getKeyWord() == "media":
-            self.processMediaQuery(token)
+        elif token.isAtRule() and token.getKeyWord() in ["extend", "media"]:
+            profiler = scssprofiler.ActiveProfiler
+            if profiler:
+                profiler.enter("directive", "@" + token.getKeyWord())
+            try:
+                if token.getKeyWord() == "extend":
+                    self.processExtend(token)
+                else:
+                    self.processMediaQuery(token)
+            finally:
+                if profiler:
+                    profiler.leave()
+
+    # compiles the children of the token from the given index on, up to the
+    # given end token, or up to the last child if there's none
+    def compileChildren(self, token, index, end, options):
+        while index < len(token.children):
+            child = token.children[index]
+            if child is end:
+                break
+            if child.parent == None:
+                raise SCSSCompileError("Child is looking for its parents, please report at the tent next to the main stage", child)
+            self.compile(child, options)
+            if child.parent: # the token could have been removed
+                index += 1
+
+            # tokens a loop left in its place are compiled already
+            index += self.numCompiledTokens
+            self.numCompiledTokens = 0
 
     def compileAtRule(self, token, options):
         keyword = token.getKeyWord()
+        profiler = scssprofiler.ActiveProfiler
+        if profiler and keyword in ["include", "mixin", "function", "import", "warn", "if", "for", "each", "while"]:
+            profiler.enter("directive", "@" + keyword)
+            try:
+                self.processAtRule(keyword, token, options)
+            finally:
+                profiler.leave()
+        else:
+            self.processAtRule(keyword, token, options)
+
+    def processAtRule(self, keyword, token, options):
         if keyword == "include":
             self.processInclude(token)
         elif keyword == "mixin":
@@ -87,6 +134,8 @@ class SCSSCompiler(object):
             self.processWarn(token)
         elif keyword == "if":
             self.processIf(token)
+        elif keyword in ["for", "each", "while"]:
+            self.processLoop(token, options)
 
     def processInclude(self, token):
         nameToken = token.getFirstChild(True).getNextSibling(True)
@@ -106,7 +155,15 @@ class SCSSCompiler(object):
         if not scope.hasMixin(name):
             raise SCSSCompileError("No mixin defined with the name %s" % name, token)
 
-        tokens = scope.getMixin(name).evaluate(scope, arguments)
+        profiler = scssprofiler.ActiveProfiler
+        if profiler:
+            profiler.enter("mixin", name)
+        try:
+            tokens = scope.getMixin(name).evaluate(scope, arguments)
+        finally:
+            if profiler:
+                profiler.leave()
+
         index = token.ownIndex() + 1
         for newToken in tokens:
             token.parent.insertAt(index, newToken)
@@ -198,14 +255,7 @@ class SCSSCompiler(object):
             if len(tokens) == 0:
                 value = not alreadyTrue
             else:
-                expression = scssexpression.SCSSExpression(tokens)
-                expression.evaluate(self.getCurrentScope())
-                if len(expression.tokens) == 0:
-                    value = False
-                elif len(expression.tokens) == 1:
-                    value = bool(scssvariables.SCSSVariable.fromToken(expression.tokens[0]))
-                else:
-                    value = True
+                value = SCSSExpression.evaluateCondition(token, tokens, self.getCurrentScope())
 
         if value:
             block = token.getBlock()
@@ -221,6 +271,35 @@ class SCSSCompiler(object):
             self.processIf(nextToken, elseIf = True, alreadyTrue = value or alreadyTrue)
         token.remove()
 
+    # the body of the loop is compiled for every iteration, in the scope of the
+    # iteration, in place of the loop
+    def processLoop(self, token, options):
+        loop = SCSSLoop(token)
+        block = token.getBlock()
+        if not block:
+            raise SCSSCompileError("@%s directive is missing a body" % loop.keyword, token)
+        SCSSProgram.compileTokens(block.children)
+
+        parent = token.parent
+        end = token.getNextSibling()
+        for scope in loop.iterate(self.getCurrentScope()):
+            start = end.ownIndex() if end else len(parent.children)
+            index = start
+            for child in block.children[1:-1]:
+                parent.insertAt(index, child.clone())
+                index += 1
+
+            self.scopes.append(scope)
+            try:
+                self.compileChildren(parent, start, end, options)
+            finally:
+                self.scopes.pop()
+
+        index = end.ownIndex() if end else len(parent.children)
+        numCompiledTokens = index - token.ownIndex() - 1
+        token.remove()
+        self.numCompiledTokens = numCompiledTokens
+
     def compileDeclaration(self, token):
         self.processNestedProperties(token)
 
@@ -258,58 +337,58 @@ class SCSSCompiler(object):
         if len(nestedRules) == 0:
             return
 
-        parentSelector = token.getSelector()
-        parentSubSelectors = parentSelector.getSubSelectors()
+        parentSubSelectors = token.getSelector().getSubSelectors()
         for ruleSet in reversed(nestedRules):
             selector = ruleSet.getSelector()
 
-            ampersand = selector.getAmpersand()
-            if ampersand:
-                while ampersand:
-                    elderly = []
-                    sibling = ampersand.getPreviousSibling()
-                    while sibling:
-                        elderly.insert(0, sibling)
-                        sibling = sibling.getPreviousSibling()
-                    youngsters = []
-                    sibling = ampersand.getNextSibling()
-                    while sibling:
-                        youngsters.append(sibling)
-                        sibling = sibling.getNextSibling()
+            atoms = selector.getSharedAtoms()
+            ampersand = self.findAmpersand(atoms)
+            if ampersand != None:
+                while ampersand != None:
+                    elderly = atoms[:ampersand]
+                    youngsters = atoms[ampersand + 1:]
 
                     ampersand = None
-                    selector.children = []
+                    atoms = []
                     for sub1 in parentSubSelectors:
-                        for child in elderly:
-                            selector.add(child.clone())
-                        for child in sub1:
-                            selector.add(child.clone())
-                        for child in youngsters:
-                            clone = child.clone()
-                            selector.add(clone)
-                            if not ampersand and child.isDelimiter("&"):
-                                ampersand = clone
-                        selector.createDelimiterChild(",")
-                    selector.getLastChild().remove() # remove last comma
+                        atoms.extend(elderly)
+                        atoms.extend(sub1)
+                        if ampersand == None:
+                            ampersand = self.findAmpersand(youngsters)
+                            if ampersand != None:
+                                ampersand += len(atoms)
+                        atoms.extend(youngsters)
+                        atoms.append(cssparser.SELECTOR_COMMA)
+                    atoms = atoms[:-1] # remove last comma
+                selector.setAtoms(atoms)
             else:
-                subSelectors = selector.getSubSelectors()
-                selector.children = []
-                for sub1 in parentSubSelectors:
-                    for sub2 in subSelectors:
-                        for child in sub1:
-                            selector.add(child.clone())
-                        selector.createSpaceChild()
-                        for child in sub2:
-                            selector.add(child.clone())
-                        selector.createDelimiterChild(",")
-                selector.getLastChild().remove() # remove last comma
+                selector.setAtoms(self.combineSelectors(parentSubSelectors, selector.getSubSelectors()))
 
             token.removeChild(ruleSet)
             ruleSet.insertAfter(token)
 
+    # returns the index of the first & in the atoms of a selector
+    def findAmpersand(self, atoms):
+        for i in range(0, len(atoms)):
+            if atoms[i].isDelimiter("&"):
+                return i
+        return None
+
+    # returns the atoms of the selector that selects every sub-selector in
+    # subSelectors2 as a descendant of every sub-selector in subSelectors1
+    def combineSelectors(self, subSelectors1, subSelectors2):
+        atoms = []
+        for sub1 in subSelectors1:
+            for sub2 in subSelectors2:
+                atoms.extend(sub1)
+                atoms.append(cssparser.SELECTOR_SPACE)
+                atoms.extend(sub2)
+                atoms.append(cssparser.SELECTOR_COMMA)
+        return atoms[:-1] # remove last comma
+
     def compileValue(self, token):
-        expression = SCSSExpression.fromToken(token)
-        tokens = expression.evaluate(self.getCurrentScope())
+        tokens = SCSSExpression.evaluateTokens(token, token.getStrippedChildren(), self.getCurrentScope())
+        token.program = None # it doesn't apply to the evaluated tokens
         if tokens:
             token.setChildren(tokens)
 
@@ -319,23 +398,38 @@ class SCSSCompiler(object):
             token.replaceWith(SCSSExpression.processInterpolation(token, self.getCurrentScope()))
 
     def processExtend(self, token):
-        ruleSets = token.getStyleSheet().getRuleSets()
-        mySelector = token.getParentRuleSet().getSelector()
-        options = cssparser.CSSOptions(stripWhiteSpace = True)
-        signatureString = cssparser.tokenListToString(token.getSignature(), options)
-        for ruleSet in ruleSets:
-            selector = ruleSet.getSelector()
-            for sub1 in selector.getSubSelectors():
-                if cssparser.tokenListToString(sub1, options) == signatureString:
-                    for sub2 in mySelector.getSubSelectors():
-                        if selector.getLastChild().isWhiteSpace():
-                            selector.getLastChild().remove()
-                        selector.createDelimiterChild(",")
-                        for child in sub2:
-                            selector.add(child.clone())
-                    break
+        token.getStyleSheet().addExtend(token.getParentRuleSet(), cssparser.selectorKey(token.getSignature()))
         token.remove()
 
+    # applies all extends in the style sheet, after it's compiled so that the
+    # selectors of nested rule sets are complete
+    def processExtends(self, styleSheet):
+        extends = styleSheet.takeExtends()
+        if len(extends) == 0:
+            return
+
+        profiler = scssprofiler.ActiveProfiler
+        if profiler:
+            profiler.enter("directive", "@extend")
+        try:
+            index = styleSheet.getSelectorIndex()
+            for (myRuleSet, key) in extends:
+                mySubSelectors = myRuleSet.getSelector().getSubSelectors()
+                for ruleSet in index.get(key, [])[:]:
+                    selector = ruleSet.getSelector()
+                    atoms = list(selector.getAtoms())
+                    for sub in mySubSelectors:
+                        if atoms[-1].isWhiteSpace():
+                            atoms.pop()
+                        atoms.append(cssparser.SELECTOR_COMMA)
+                        atoms.extend(sub)
+                    selector.setAtoms(atoms)
+                    styleSheet.indexRuleSet(ruleSet)
+        finally:
+            styleSheet.dropSelectorIndex()
+            if profiler:
+                profiler.leave()
+
     def processMediaQuery(self, token):
         while not token.parent.isStyleSheet():
             parent = token.parent
@@ -344,17 +438,8 @@ class SCSSCompiler(object):
                 for child in token.getBlock().children[:]:
                     if child.isRuleSet():
                         selector = child.getSelector()
-                        subSelectors = selector.getSubSelectors()
-                        selector.setChildren([])
-                        for sub1 in parent.getSelector().getSubSelectors():
-                            for sub2 in subSelectors:
-                                for sub1Child in sub1:
-                                    selector.adopt(sub1Child.clone())
-                                selector.createDelimiterChild(" ")
-                                for sub2Child in sub2:
-                                    selector.adopt(sub2Child.clone())
-                                selector.createDelimiterChild(",")
-                        selector.getLastChild().remove() # remove last comma
+                        selector.setAtoms(self.combineSelectors(parent.getSelector().getSubSelectors(),
+                                                                selector.getSubSelectors()))
                     elif child.isDeclaration():
                         if ruleSet == None:
                             ruleSet = cssparser.CSSRuleSetToken(token.getBlock())
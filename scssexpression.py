@@ -1,5 +1,6 @@
 import cssparser
 import re
+import scssprofiler
 import scssvariables
 
 from scssexceptions import *
@@ -17,7 +18,7 @@ class SCSSExpression(object):
             options.compileScss = True
         else:
             options = cssparser.CSSOptions(compileScss = True)
-        stream = cssparser.CSSStream(expression, options)
+        stream = cssparser.createStream(expression, options)
         return SCSSExpression.fromStream(stream)
 
     @staticmethod
@@ -39,7 +40,7 @@ class SCSSExpression(object):
     @staticmethod
     def processInterpolation(token, scope = None):
         result = ""
-        stream = cssparser.CSSStream(token.data[1:-1] if token.isString() else token.data)
+        stream = cssparser.createStream(token.data[1:-1] if token.isString() else token.data)
         character = stream.take()
         while character != cssparser.CSS_EOF:
             if character == "#" and stream.current() == "{":
@@ -61,7 +62,16 @@ class SCSSExpression(object):
     @staticmethod
     def processAssignment(token, scope):
         name = token.getVariable().getName()
-        expression = SCSSExpression.fromToken(token.getValue())
+        value = token.getValue()
+        if value.program: # never compiled for !default assignments
+            tokens = value.program.run(value.getStrippedChildren(), scope)
+            if len(tokens) == 1:
+                scope.set(name, scssvariables.SCSSVariable.fromToken(tokens[0], scope))
+            else:
+                scope.set(name, scssvariables.SCSSList.fromTokens(tokens, scope))
+            return
+
+        expression = SCSSExpression.fromToken(value)
 
         if (len(expression.tokens) > 0 and
             expression.value.getLastChild(True).isKeyword("!default")):
@@ -101,6 +111,58 @@ class SCSSExpression(object):
         else:
             return scssvariables.SCSSList.fromTokens(expression.tokens, scope)
 
+    # evaluates a function token, returns the token holding the result of the
+    # call, or the token itself if it's not an SCSS function
+    @staticmethod
+    def evaluateFunction(token, scope):
+        name = token.getName()
+        if scope.hasFunction(name):
+            function = scope.getFunction(name)
+            arguments = token.getArguments(includeCommas = True)
+            profiler = scssprofiler.ActiveProfiler
+            if profiler:
+                profiler.enter("function", name)
+            try:
+                value = function.evaluate(scope, arguments)
+            finally:
+                if profiler:
+                    profiler.leave()
+            return value.toToken()
+        elif re.match("(-[a-z]+-)?calc", name):
+            for child in token.children:
+                if child.isVariable():
+                    value = scssvariables.SCSSVariable.fromToken(token, scope)
+                    child.replaceWith(value.toToken())
+        else:
+            expression = SCSSExpression(token.children)
+            expression.evaluate(scope)
+            token.children = []
+            for child in expression.tokens:
+                token.add(child)
+        return token
+
+    # evaluates the given tokens, which belong to the owner token, using the
+    # program compiled for the owner if there is one
+    @staticmethod
+    def evaluateTokens(owner, tokens, scope):
+        if owner.program:
+            return owner.program.run(tokens, scope)
+
+        expression = SCSSExpression(tokens)
+        return expression.evaluate(scope)
+
+    # evaluates the given tokens as the condition of an @if, @else if or @while
+    # directive, returns whether it holds
+    @staticmethod
+    def evaluateCondition(owner, tokens, scope):
+        tokens = SCSSExpression.evaluateTokens(owner, tokens, scope)
+        if len(tokens) == 0:
+            return False
+        elif len(tokens) == 1:
+            return bool(scssvariables.SCSSVariable.fromToken(tokens[0]))
+        else:
+            return True
+
     def evaluate(self, scope = None, parentPriority = 0, startIndex = 0, processSlash = False):
         i = startIndex
         returnTokens = []
@@ -117,24 +179,9 @@ class SCSSExpression(object):
                 value = scssvariables.SCSSVariable.fromToken(token, scope)
                 self.value.replaceAt(i, 1, value.toToken())
             elif token.isFunction():
-                name = token.getName()
-                if scope.hasFunction(name):
-                    function = scope.getFunction(name)
-                    arguments = token.getArguments(includeCommas = True)
-                    value = function.evaluate(scope, arguments)
-                    self.value.replaceAt(i, 1, value.toToken())
-                elif re.match("(-[a-z]+-)?calc", name):
-                    for child in token.children:
-                        if child.isVariable():
-                            value = scssvariables.SCSSVariable.fromToken(token, scope)
-                            child.replaceWith(value.toToken())
-                else:
-                    expression = SCSSExpression(token.children)
-                    expression.evaluate(scope)
-                    token.children = []
-                    for child in expression.tokens:
-                        token.add(child)
-
+                result = SCSSExpression.evaluateFunction(token, scope)
+                if result is not token:
+                    self.value.replaceAt(i, 1, result)
             else:
                 priority = self.priorityFromToken(token)
 
@@ -224,7 +271,8 @@ class SCSSExpression(object):
         else:
             return self.tokens
 
-    def priorityFromToken(self, token):
+    @staticmethod
+    def priorityFromToken(token):
         if token.isKeyword("not"):
             return 5
         if token.isDelimiter("*/%"):
@@ -240,7 +288,4 @@ class SCSSExpression(object):
         return 0    
 
     def toString(self, options = cssparser.CSSOptions()):
-        string = ""
-        for token in self.tokens:
-            string += token.toString(options)
-        return string
+        return cssparser.tokenListToString(self.tokens, options)
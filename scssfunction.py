@@ -1,3 +1,4 @@
+import re
 import types
 
 import scssvariables
@@ -7,7 +8,19 @@ from scssexpression import SCSSExpression
 from scssscope import SCSSScope
 
 
+INTERPOLATED_VARIABLE_PATTERN = re.compile(r"\$([a-zA-Z_][\w-]*)")
+INTERPOLATED_FUNCTION_PATTERN = re.compile(r"([a-zA-Z_-][\w-]*)\(")
+
+
 class SCSSFunction(object):
+    # the cache used for the results of function calls, if any
+    cache = None
+
+    # every function definition gets its own serial number, which identifies
+    # it in the cache (cloned scopes share the definitions they inherit, so a
+    # serial number always refers to the same definition)
+    numDefinitions = 0
+
     def __init__(self, name, scope, arguments, body):
         self.name = name
         self.scope = SCSSScope(scope)
@@ -15,12 +28,26 @@ class SCSSFunction(object):
         self.numArgs = len(self.arguments)
         self.body = self.tokenToBody(body)
 
+        self.serial = SCSSFunction.numDefinitions
+        SCSSFunction.numDefinitions += 1
+        self.pure = None
+        self.compiled = False
+
     @staticmethod
     def registerBuiltinFunctions(scope):
         import scssbuiltinfunctions
         for function in scssbuiltinfunctions.FUNCTIONS:
             scope.setFunction(function.name, function)
 
+    # sets the cache used for the results of calls to pure functions, or None
+    # to disable caching
+    @staticmethod
+    def setCache(cache):
+        SCSSFunction.cache = cache
+
+    def isBuiltin(self):
+        return False
+
     def typeName(self):
         import scssmixin
         return "mixin" if isinstance(self, scssmixin.SCSSMixin) else "function"
@@ -163,25 +190,200 @@ class SCSSFunction(object):
 
     def evaluate(self, callerScope, arguments = None):
         try:
+            self.compilePrograms()
             scope = self.scope.clone()
             if arguments:
                 self.mapArguments(arguments, callerScope, scope)
-    
-            for token in self.body:
-                if token.isAssignment():
-                    SCSSExpression.processAssignment(token, scope)
-                elif token.isAtRule() and token.getKeyWord() == "return":
-                    expression = SCSSExpression(token.getSignature())
-                    expression.evaluate(scope)
-                    if len(expression.tokens) == 0:
-                        raise SCSSRunTimeError("Could not evaluate return statement of function %s" % self.name)
-                    elif len(expression.tokens) == 1:
-                        return scssvariables.SCSSVariable.fromToken(expression.tokens[0])
-                    else:
-                        return scssvariables.SCSSList.fromTokens(expression.tokens)
-                else:
-                    raise SCSSRunTimeError("Unexpected token in function %s" % self.name, token)
-    
-            raise SCSSRunTimeError("Function %s does not return a value" % self.name)
+
+            cacheKey = None
+            if SCSSFunction.cache:
+                cacheKey = self.cacheKey(scope)
+                if cacheKey:
+                    result = SCSSFunction.cache.get(cacheKey)
+                    if result is not None:
+                        return result
+
+            result = self.evaluateBody(scope)
+            if cacheKey:
+                SCSSFunction.cache.add(cacheKey, result)
+            return result
         except Exception, exception:
             raise SCSSRunTimeError(str(exception) + "\n  In call to function " + self.name)
+
+    def evaluateBody(self, scope):
+        result = self.evaluateStatements(self.body, scope)
+        if result is None:
+            raise SCSSRunTimeError("Function %s does not return a value" % self.name)
+        return result
+
+    # evaluates the given statements, returns the value of the first @return
+    # statement that is reached, or None if there's none
+    def evaluateStatements(self, statements, scope):
+        branchTaken = None # whether a branch of the current @if/@else chain was taken
+        for token in statements:
+            keyword = token.getKeyWord() if token.isAtRule() else None
+            if keyword == "else":
+                if branchTaken is None:
+                    raise SCSSRunTimeError("@else without @if in function %s" % self.name, token)
+                if branchTaken:
+                    continue
+                tokens = token.getSignature()
+                if len(tokens) > 0 and tokens[0].isKeyword("if"):
+                    branchTaken = self.evaluateCondition(token, tokens[1:], scope)
+                else:
+                    branchTaken = True
+                if branchTaken:
+                    result = self.evaluateStatements(self.tokenToBody(token.getBlock()), scope)
+                    if result is not None:
+                        return result
+                continue
+
+            branchTaken = None
+            if token.isAssignment():
+                # evaluating resolves variables into the tokens, so the body is
+                # cloned to keep it intact for the next call
+                SCSSExpression.processAssignment(token.clone(), scope)
+            elif keyword == "return":
+                token = token.clone()
+                tokens = SCSSExpression.evaluateTokens(token, token.getSignature(), scope)
+                if len(tokens) == 0:
+                    raise SCSSRunTimeError("Could not evaluate return statement of function %s" % self.name)
+                elif len(tokens) == 1:
+                    return scssvariables.SCSSVariable.fromToken(tokens[0])
+                else:
+                    return scssvariables.SCSSList.fromTokens(tokens)
+            elif keyword == "if":
+                branchTaken = self.evaluateCondition(token, token.getSignature(), scope)
+                if branchTaken:
+                    result = self.evaluateStatements(self.tokenToBody(token.getBlock()), scope)
+                    if result is not None:
+                        return result
+            elif keyword in ["for", "each", "while"]:
+                import scssloop
+                loop = scssloop.SCSSLoop(token)
+                body = self.tokenToBody(token.getBlock())
+                for loopScope in loop.iterate(scope):
+                    result = self.evaluateStatements(body, loopScope)
+                    if result is not None:
+                        return result
+            else:
+                raise SCSSRunTimeError("Unexpected token in function %s" % self.name, token)
+
+        return None
+
+    def evaluateCondition(self, token, tokens, scope):
+        if len(tokens) == 0:
+            raise SCSSRunTimeError("Missing condition in function %s" % self.name, token)
+        tokens = [child.clone() for child in tokens]
+        return SCSSExpression.evaluateCondition(token, tokens, scope)
+
+    # compiles the expressions in the body into programs, which is done when the
+    # function is first called, so functions that are never called don't pay
+    # for it
+    def compilePrograms(self):
+        if self.compiled:
+            return
+        import scssprogram
+        scssprogram.SCSSProgram.compileTokens(self.bodyTokens())
+        self.compiled = True
+
+    # determines whether the function is pure, meaning its result depends only
+    # on its arguments and the variables, functions and mixins it refers to,
+    # and collects the names of those
+    def analyze(self):
+        self.pure = True
+        self.variableNames = set()
+        self.functionNames = set()
+        self.mixinNames = set()
+        for token in self.bodyTokens():
+            self.analyzeToken(token)
+
+        for (name, defaultValue) in self.arguments:
+            self.variableNames.add(name)
+
+    def analyzeToken(self, token):
+        if token.isVariable():
+            self.variableNames.add(token.getName())
+        elif token.isFunction():
+            self.functionNames.add(token.getName())
+        elif token.isAtRule():
+            keyword = token.getKeyWord()
+            if not self.isPureDirective(keyword):
+                self.pure = False
+            elif keyword == "include":
+                nameToken = token.getFirstChild(True).getNextSibling(True)
+                if nameToken and nameToken.isIdentifier():
+                    self.mixinNames.add(nameToken.data)
+                elif nameToken and nameToken.isFunction():
+                    self.mixinNames.add(nameToken.getName())
+        elif (token.isString() or token.isIdentifier()) and "#{" in token.data:
+            # interpolated expressions are not parsed into tokens, so the names
+            # they refer to are picked from the text
+            for name in INTERPOLATED_VARIABLE_PATTERN.findall(token.data):
+                self.variableNames.add(name)
+            for name in INTERPOLATED_FUNCTION_PATTERN.findall(token.data):
+                self.functionNames.add(name)
+
+        for child in token.children:
+            self.analyzeToken(child)
+
+    # returns the tokens that make up the body of the function
+    def bodyTokens(self):
+        return self.body
+
+    # returns whether the given directive may occur in the body of a pure
+    # function
+    def isPureDirective(self, keyword):
+        return keyword in ["return", "if", "else", "for", "each", "while"]
+
+    # returns the key under which the result of calling the function with the
+    # given scope is cached, or None if the result should not be cached
+    def cacheKey(self, scope, callers = []):
+        if self.pure == None:
+            self.analyze()
+        if not self.pure or self.numArgs == -1:
+            return None
+
+        key = [self.serial]
+        for name in sorted(self.variableNames):
+            if scope.has(name):
+                value = scope.get(name)
+                valueKey = value.cacheKey() if value is not None else None
+                if valueKey is None:
+                    return None
+                key.append((name, valueKey))
+            else:
+                key.append((name, "undefined"))
+
+        callers = callers + [self.serial]
+        for name in sorted(self.functionNames):
+            if not scope.hasFunction(name):
+                key.append((name, "undefined"))
+                continue
+
+            function = scope.getFunction(name)
+            if function.isBuiltin():
+                key.append((name, "builtin"))
+            elif function.serial in callers:
+                key.append((name, function.serial)) # recursive call
+            else:
+                functionKey = function.cacheKey(function.scope, callers)
+                if functionKey is None:
+                    return None
+                key.append((name, functionKey))
+
+        for name in sorted(self.mixinNames):
+            if not scope.hasMixin(name):
+                key.append(("@" + name, "undefined"))
+                continue
+
+            mixin = scope.getMixin(name)
+            if mixin.serial in callers:
+                key.append(("@" + name, mixin.serial)) # recursive include
+            else:
+                mixinKey = mixin.cacheKey(mixin.scope, callers)
+                if mixinKey is None:
+                    return None
+                key.append(("@" + name, mixinKey))
+
+        return tuple(key)
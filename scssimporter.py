@@ -1,11 +1,11 @@
 from __future__ import with_statement
 
 import codecs
-import copy
 import os
 
 import cssparser
 import scsscompiler
+import scssprofiler
 
 from scssexceptions import *
 
@@ -14,35 +14,31 @@ class SCSSImporter(object):
     def __init__(self):
         self.imports = {}
         self.paths = ["stylesheets"]
+        self.parseCache = None
 
     def addPath(self, path):
         self.paths.append(path)
 
+    # forgets about all files imported so far, so that the next compile starts
+    # with a clean slate (parsed files are still reused through the parse cache)
+    def reset(self):
+        self.imports = {}
+
+    # sets the cache used for storing parsed imports, or None to
+    # parse every import from scratch
+    def setParseCache(self, parseCache):
+        self.parseCache = parseCache
+
     def importScss(self, scope, token, fileName, options):
         myStyleSheet = token
         while not myStyleSheet.isStyleSheet():
             myStyleSheet = myStyleSheet.parent
 
-        css = None
-        extension = ".scss" if len(fileName) < 5 or fileName[-5] != ".scss" else ""
-        paths = copy.copy(self.paths)
-        paths.append(myStyleSheet.path)
-        importPath = ""
-        for prefix in paths:
-            path = prefix + "/" + fileName + extension
-            (dir, file) = os.path.split(path)
-            hiddenPath = dir + "/_" + file
-
-            if os.path.exists(hiddenPath):
-                options.importCss = False
-                importPath = hiddenPath
-                break
-            if os.path.exists(path):
-                importPath = path
-                break
-
+        (importPath, isPartial) = self.findImport(fileName, myStyleSheet.path)
         if not importPath:
-            raise SCSSRunTimeError("Could not find import \"%s\" in search path: %s" % (fileName, paths))
+            raise SCSSRunTimeError("Could not find import \"%s\" in search path: %s" % (fileName, self.paths + [myStyleSheet.path]))
+        if isPartial:
+            options.importCss = False
 
         if importPath in self.imports:
             (importScope, styleSheet) = self.imports[importPath]
@@ -55,17 +51,27 @@ class SCSSImporter(object):
         else:
             self.imports[importPath] = (None, None)
 
-            with codecs.open(importPath, "r") as f:
-                css = f.read()
-
-            parser = cssparser.CSSParser()
-            styleSheet = parser.parse(css, options)
-            (directory, fileName) = os.path.split(path)
-            styleSheet.setPath(directory)
-
-            compiler = scsscompiler.SCSSCompiler()
-            compiler.setGlobalScope(scope)
-            compiler.compile(styleSheet, options)
+            profiler = scssprofiler.ActiveProfiler
+            if profiler:
+                profiler.enter("import", importPath)
+            try:
+                if profiler:
+                    profiler.enter("phase", "parse")
+                try:
+                    styleSheet = self.parseFile(importPath, options)
+                finally:
+                    if profiler:
+                        profiler.leave()
+
+                (directory, fileName) = os.path.split(importPath)
+                styleSheet.setPath(directory)
+
+                compiler = scsscompiler.SCSSCompiler()
+                compiler.setGlobalScope(scope)
+                compiler.compile(styleSheet, options)
+            finally:
+                if profiler:
+                    profiler.leave()
 
             if options.importCss:
                 self.importStyleSheet(token, styleSheet)
@@ -73,6 +79,32 @@ class SCSSImporter(object):
             else:
                 self.imports[importPath] = (scope, None)
 
+    # returns the path of the file imported by the given name, searching the
+    # import paths followed by the given directory, together with whether the
+    # file is a partial, returns (None, False) if the file cannot be found
+    def findImport(self, fileName, directory):
+        extension = ".scss" if len(fileName) < 5 or fileName[-5] != ".scss" else ""
+        for prefix in self.paths + [directory]:
+            path = prefix + "/" + fileName + extension
+            (dir, file) = os.path.split(path)
+            hiddenPath = dir + "/_" + file
+
+            if os.path.exists(hiddenPath):
+                return (hiddenPath, True)
+            if os.path.exists(path):
+                return (path, False)
+        return (None, False)
+
+    def parseFile(self, path, options):
+        if self.parseCache:
+            return self.parseCache.parse(path, options)
+
+        with codecs.open(path, "r") as f:
+            css = f.read()
+
+        parser = cssparser.CSSParser()
+        return parser.parse(css, options)
+
     def importStyleSheet(self, token, styleSheet):
         insertToken = token
         styleSheet = styleSheet.clone()
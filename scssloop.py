@@ -0,0 +1,89 @@
+import scssvariables
+
+from scssexceptions import *
+from scssexpression import SCSSExpression
+from scssprogram import SCSSProgram
+from scssscope import SCSSLoopScope
+
+
+# a @for, @each or @while directive. the signature of the directive is parsed
+# once, after which iterate() gives the scope to evaluate the body of the loop
+# in for every iteration.
+#
+# the tokens of the signature are cloned before they are evaluated, so the
+# directive itself is never modified and the loop can be run again
+class SCSSLoop(object):
+    def __init__(self, token):
+        self.token = token
+        self.keyword = token.getKeyWord()
+        tokens = token.getSignature()
+
+        if self.keyword == "while":
+            if len(tokens) == 0:
+                raise SCSSCompileError("@while directive is missing a condition", token)
+            self.condition = tokens
+            self.program = SCSSProgram.fromTokens(tokens)
+            return
+
+        if len(tokens) < 3 or not tokens[0].isVariable():
+            raise SCSSCompileError("@%s directive should start with a variable" % self.keyword, token)
+        self.name = tokens[0].getName()
+
+        if self.keyword == "for":
+            if not tokens[1].isKeyword("from"):
+                raise SCSSCompileError("Expected \"from\" in @for directive", token)
+            i = 2
+            while i < len(tokens) and not (tokens[i].isKeyword("through") or tokens[i].isKeyword("to")):
+                i += 1
+            if i == 2 or i >= len(tokens) - 1:
+                raise SCSSCompileError("Expected \"from <start> through <end>\" or \"from <start> to <end>\" in @for directive", token)
+            self.start = tokens[2:i]
+            self.end = tokens[i + 1:]
+            self.inclusive = tokens[i].isKeyword("through")
+        elif self.keyword == "each":
+            if not tokens[1].isKeyword("in"):
+                raise SCSSCompileError("Expected \"in\" in @each directive", token)
+            self.list = tokens[2:]
+        else:
+            raise SCSSCompileError("Unknown loop directive @%s" % self.keyword, token)
+
+    # returns the scopes for all iterations of the loop in the given scope, one
+    # at a time, so the body of every iteration is evaluated before the next
+    # scope is determined
+    def iterate(self, scope):
+        if self.keyword == "while":
+            while SCSSExpression.evaluateCondition(self, self.cloneTokens(self.condition), scope):
+                yield scope # there's no loop variable to bind
+        elif self.keyword == "for":
+            start = self.evaluateNumber(self.start, scope)
+            end = self.evaluateNumber(self.end, scope)
+            step = 1 if end.value >= start.value else -1
+            stop = int(end.value) + step if self.inclusive else int(end.value)
+            for i in xrange(int(start.value), stop, step):
+                yield SCSSLoopScope(scope, self.name, scssvariables.SCSSNumber(intVal = i, unit = start.unit))
+        elif not self.isEmptyList(self.list):
+            value = self.evaluate(self.list, scope)
+            items = value.items if value.isList() else [value]
+            for item in items:
+                yield SCSSLoopScope(scope, self.name, item)
+
+    # an empty list, (), cannot be evaluated, but gives no iterations
+    def isEmptyList(self, tokens):
+        tokens = [token for token in tokens if not token.isWhiteSpace()]
+        return len(tokens) == 1 and tokens[0].isSet() and len(tokens[0].getStrippedChildren()) == 0
+
+    def cloneTokens(self, tokens):
+        return [token.clone() for token in tokens]
+
+    def evaluate(self, tokens, scope):
+        tokens = SCSSExpression(self.cloneTokens(tokens)).evaluate(scope)
+        if len(tokens) == 1:
+            return scssvariables.SCSSVariable.fromToken(tokens[0], scope)
+        else:
+            return scssvariables.SCSSList.fromTokens(tokens, scope)
+
+    def evaluateNumber(self, tokens, scope):
+        value = self.evaluate(tokens, scope)
+        if not value.isNumber():
+            raise SCSSRunTimeError("Bounds of @for directive should be numbers, not \"%s\"" % value.toString())
+        return value
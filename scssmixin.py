@@ -2,24 +2,55 @@ from scssexceptions import *
 from scssfunction import SCSSFunction
 
 
+# directives that make the expansion of a mixin depend on more than its
+# arguments and the variables, functions and mixins it refers to
+IMPURE_DIRECTIVES = ["content", "extend", "function", "import", "mixin", "warn"]
+
 class SCSSMixin(SCSSFunction):
+    # the cache used for the expansions of mixins, if any
+    cache = None
+
     def __init__(self, name, scope, arguments, body):
         SCSSFunction.__init__(self, name, scope, arguments, body)
 
+    # sets the cache used for the expansions of pure mixins, or None to disable
+    # caching
+    @staticmethod
+    def setCache(cache):
+        SCSSMixin.cache = cache
+
     def tokenToBody(self, token):
         return token.clone()
 
     def evaluate(self, callerScope, arguments = None):
         try:
+            self.compilePrograms()
             scope = self.scope.clone()
             if arguments != None:
                 self.mapArguments(arguments, callerScope, scope)
-    
+
+            cacheKey = None
+            if SCSSMixin.cache:
+                cacheKey = self.cacheKey(scope)
+                if cacheKey:
+                    tokens = SCSSMixin.cache.get(cacheKey)
+                    if tokens is not None:
+                        return tokens
+
             body = self.body.clone()
             import scsscompiler
             compiler = scsscompiler.SCSSCompiler()
             compiler.setGlobalScope(scope)
             compiler.compile(body)
-            return body.children[1:-1]
+            tokens = body.children[1:-1]
+            if cacheKey:
+                SCSSMixin.cache.add(cacheKey, tokens)
+            return tokens
         except Exception, exception:
             raise SCSSRunTimeError(str(exception) + "\n  In call to mixin " + self.name)
+
+    def bodyTokens(self):
+        return self.body.children
+
+    def isPureDirective(self, keyword):
+        return keyword not in IMPURE_DIRECTIVES
@@ -0,0 +1,94 @@
+import json
+import time
+
+
+# the profiler currently recording, if any
+#
+# the compiler creates new compiler instances for imports and mixins, so the
+# profiler is kept here instead of being passed around
+ActiveProfiler = None
+
+# the formats of the frames that make up the folded stacks, entries of other
+# categories (phases, directives) are attributed to the frame they occur in
+FOLDED_FRAMES = {
+    "file": "%s",
+    "import": "@import %s",
+    "mixin": "@include %s",
+    "function": "%s()"
+}
+
+class SCSSProfiler(object):
+    def __init__(self):
+        self.entries = {}
+        self.stack = []
+        self.foldedStacks = {}
+
+    # starts timing the given entry, every call must be matched by a call to
+    # leave() once the entry is done
+    def enter(self, category, name):
+        self.stack.append([(category, name), time.time(), 0.0])
+
+    def leave(self):
+        (key, start, childTime) = self.stack.pop()
+        elapsed = time.time() - start
+
+        if key not in self.entries:
+            self.entries[key] = [0, 0.0, 0.0]
+        entry = self.entries[key]
+        entry[0] += 1
+        entry[2] += elapsed - childTime
+
+        frames = []
+        for (category, name) in [frame[0] for frame in self.stack] + [key]:
+            if category in FOLDED_FRAMES:
+                frames.append(FOLDED_FRAMES[category] % name)
+        if len(frames) > 0:
+            foldedStack = ";".join(frames)
+            self.foldedStacks[foldedStack] = self.foldedStacks.get(foldedStack, 0.0) + elapsed - childTime
+
+        # time spent in recursive calls is only counted once
+        recursive = False
+        for frame in self.stack:
+            if frame[0] == key:
+                recursive = True
+                break
+        if not recursive:
+            entry[1] += elapsed
+
+        if len(self.stack) > 0:
+            self.stack[-1][2] += elapsed
+
+    # returns the recorded entries as tuples of category, name, number of calls,
+    # total time and self time (excluding time spent in nested entries), with
+    # the most expensive entries first
+    def getEntries(self):
+        entries = []
+        for ((category, name), (numCalls, totalTime, selfTime)) in self.entries.items():
+            entries.append((category, name, numCalls, totalTime, selfTime))
+        entries.sort(key = lambda entry: (-entry[3], entry[0], entry[1]))
+        return entries
+
+    def report(self):
+        lines = ["%-10s %-40s %8s %12s %12s" % ("category", "name", "calls", "total (ms)", "self (ms)")]
+        for (category, name, numCalls, totalTime, selfTime) in self.getEntries():
+            lines.append("%-10s %-40s %8d %12.2f %12.2f" %
+                         (category, name, numCalls, totalTime * 1000, selfTime * 1000))
+        return "\n".join(lines)
+
+    def toJson(self):
+        entries = []
+        for (category, name, numCalls, totalTime, selfTime) in self.getEntries():
+            entries.append({ "category": category, "name": name, "calls": numCalls,
+                             "total": totalTime * 1000, "self": selfTime * 1000 })
+        return json.dumps({ "entries": entries }, indent = 2)
+
+    # returns the time spent in every stack of files, imports, mixins and
+    # functions in the folded stack format used by flame graph tools, with the
+    # time in microseconds
+    def toFoldedStacks(self):
+        lines = []
+        for (foldedStack, elapsed) in sorted(self.foldedStacks.items()):
+            microseconds = int(round(elapsed * 1000000))
+            if microseconds > 0:
+                lines.append("%s %d" % (foldedStack, microseconds))
+        return "\n".join(lines)
@@ -0,0 +1,336 @@
+import scssvariables
+
+from scssexceptions import *
+from scssexpression import SCSSExpression
+
+
+# the kinds of cells an expression consists of while it's being compiled
+WHITESPACE = 0
+OPERATOR = 1
+LITERAL = 2
+VARIABLE = 3
+SET = 4
+FUNCTION = 5
+VALUE = 6 # an evaluated variable or set, or the result of an operation
+FUNCTION_VALUE = 7 # an evaluated function, which is a value only if the function is defined
+
+# instructions
+EVALUATE = 0
+APPLY = 1
+
+# operands of instructions
+TOKEN = 0
+REGISTER = 1
+ZERO = 2
+NOTHING = 3
+
+
+# raised when an expression cannot be compiled into a program, either because
+# it's not supported, or because its evaluation would fail
+class SCSSUnsupportedExpression(Exception):
+    pass
+
+
+# a token of an expression, or the result of evaluating one, as seen while
+# compiling the expression
+class SCSSProgramCell(object):
+    __slots__ = ("kind", "index", "register", "data", "priority", "program")
+
+    def __init__(self, kind, index = None, register = None):
+        self.kind = kind
+        self.index = index
+        self.register = register
+        self.data = None
+        self.priority = 0
+        self.program = None
+
+    def isVariable(self):
+        if self.kind == FUNCTION_VALUE:
+            raise SCSSUnsupportedExpression() # depends on whether the function is defined
+        return self.kind == VARIABLE or self.kind == VALUE
+
+    def isOperator(self, operator):
+        return self.kind == OPERATOR and self.data == operator
+
+
+# an expression compiled into a sequence of instructions that evaluate it
+# against a scope, without having to work out the order of the operations again
+# and without modifying the tokens of the expression.
+#
+# the instructions are found by running the algorithm of SCSSExpression.evaluate()
+# on the kinds of the tokens rather than on the tokens themselves, so programs
+# evaluate expressions exactly the way SCSSExpression does. expressions for which
+# that cannot be done up front are not compiled.
+class SCSSProgram(object):
+    def __init__(self):
+        self.instructions = []
+        self.output = []
+        self.numRegisters = 0
+
+    # returns the program for evaluating the given tokens, or None if they
+    # cannot be compiled
+    @staticmethod
+    def fromTokens(tokens, processSlash = False):
+        program = SCSSProgram()
+        try:
+            program.compile(tokens, processSlash)
+        except SCSSUnsupportedExpression:
+            return None
+        return program
+
+    # compiles the expressions in the given tokens and their children, and
+    # stores the programs in the tokens holding the expressions
+    @staticmethod
+    def compileTokens(tokens):
+        for token in tokens:
+            if token.isValue():
+                token.program = SCSSProgram.fromTokens(token.getStrippedChildren())
+            elif token.isAtRule():
+                SCSSProgram.compileAtRule(token)
+
+            SCSSProgram.compileTokens(token.children)
+
+    @staticmethod
+    def compileAtRule(token):
+        keyword = token.getKeyWord()
+        if keyword not in ["if", "else", "return"]:
+            return
+
+        try:
+            tokens = token.getSignature()
+        except Exception:
+            return
+
+        if keyword == "else":
+            if len(tokens) == 0 or not tokens[0].isKeyword("if"):
+                return
+            tokens = tokens[1:]
+        if len(tokens) > 0:
+            token.program = SCSSProgram.fromTokens(tokens)
+
+    def compile(self, tokens, processSlash):
+        self.cells = []
+        for index in range(0, len(tokens)):
+            self.cells.append(self.cellFromToken(tokens[index], index))
+        if len(self.cells) > 0 and self.cells[-1].kind == LITERAL and tokens[-1].isKeyword("!default"):
+            raise SCSSUnsupportedExpression() # handled by processAssignment()
+
+        self.evaluate(0, 0, processSlash)
+        for cell in self.cells:
+            self.output.append((cell.index, cell.register))
+        del self.cells
+
+    def cellFromToken(self, token, index):
+        if token.isWhiteSpace():
+            return SCSSProgramCell(WHITESPACE, index)
+        if token.isComment():
+            raise SCSSUnsupportedExpression()
+        if (token.isString() or token.isIdentifier()) and "#{" in token.data:
+            raise SCSSUnsupportedExpression() # interpolation may change the kind of the token
+
+        if token.isSet():
+            cell = SCSSProgramCell(SET, index)
+            cell.program = SCSSProgram.fromTokens(token.getStrippedChildren(), processSlash = True)
+            if not cell.program:
+                raise SCSSUnsupportedExpression()
+            return cell
+        if token.isVariable():
+            return SCSSProgramCell(VARIABLE, index)
+        if token.isFunction():
+            return SCSSProgramCell(FUNCTION, index)
+
+        priority = SCSSExpression.priorityFromToken(token)
+        if priority > 0:
+            cell = SCSSProgramCell(OPERATOR, index)
+            cell.data = token.data
+            cell.priority = priority
+            return cell
+        return SCSSProgramCell(LITERAL, index)
+
+    def evaluateCell(self, i):
+        cell = self.cells[i]
+        if cell.kind == VALUE:
+            return # evaluating a value gives the same value
+
+        register = self.numRegisters
+        self.numRegisters += 1
+        self.instructions.append((EVALUATE, cell.kind, cell.index, register, cell.program))
+        kind = FUNCTION_VALUE if cell.kind == FUNCTION else VALUE
+        self.cells[i] = SCSSProgramCell(kind, register = register)
+
+    def operand(self, cell):
+        if cell.kind in [VARIABLE, SET, FUNCTION]:
+            raise SCSSUnsupportedExpression() # never happens for valid expressions
+        if cell.register != None:
+            return (REGISTER, cell.register)
+        return (TOKEN, cell.index)
+
+    def indexOf(self, cell):
+        for i in range(0, len(self.cells)):
+            if self.cells[i] is cell:
+                return i
+        raise SCSSUnsupportedExpression()
+
+    def nextCell(self, i):
+        i += 1
+        while i < len(self.cells):
+            if self.cells[i].kind != WHITESPACE:
+                return self.cells[i]
+            i += 1
+        return None
+
+    def previousCell(self, i):
+        i -= 1
+        while i >= 0:
+            if self.cells[i].kind != WHITESPACE:
+                return self.cells[i]
+            i -= 1
+        return None
+
+    # follows SCSSExpression.evaluate() step by step, recording the evaluations
+    # and operations it would perform as instructions
+    def evaluate(self, parentPriority, startIndex, processSlash):
+        cells = self.cells
+        i = startIndex
+        returnCells = []
+        while i < len(cells) and len(returnCells) == 0:
+            cell = cells[i]
+            if cell.kind == WHITESPACE:
+                i += 1
+                continue
+
+            if cell.kind == SET or cell.isVariable() or cell.kind == FUNCTION:
+                self.evaluateCell(i)
+            else:
+                priority = cell.priority
+
+                if priority == 0 and parentPriority > 0:
+                    j = i
+                    while j > startIndex:
+                        if cells[j].kind != WHITESPACE:
+                            returnCells = cells[startIndex:j - 1]
+                            break
+                        j -= 1
+                    if len(returnCells) > 0:
+                        break
+
+                while i < len(cells) - 1 and priority > 0:
+                    if priority and parentPriority and priority <= parentPriority:
+                        returnCells = cells[startIndex:i]
+                        break
+
+                    position = self.indexOf(cell)
+                    nextCell = self.nextCell(position)
+                    if nextCell == None:
+                        break
+
+                    nextIndex = self.indexOf(nextCell)
+                    if cell.kind == OPERATOR and cell.data == "not": # unary operator
+                        i += 1
+                        previousCell = cell
+
+                        operator = "not"
+                        operand1 = self.evaluate(priority, nextIndex, processSlash = True)
+                        operand2 = (NOTHING, None)
+                    else:
+                        previousCell = self.previousCell(position)
+                        if previousCell:
+                            # little special treatment for the / operator
+                            if (cell.isOperator("/") and not processSlash and
+                                not previousCell.isVariable() and not nextCell.isVariable()):
+                                break
+
+                            operator = cell.data
+                            operand1 = self.operand(previousCell)
+                            operand2 = self.evaluate(priority, nextIndex, processSlash = True)
+                        else:
+                            i += 1
+                            if cell.isOperator("-"): # unary operator
+                                previousCell = cell
+                                operator = "-"
+                                operand1 = (ZERO, None)
+                                operand2 = self.evaluate(priority, nextIndex, processSlash = True)
+                            else:
+                                continue
+
+                    for j in range(0, nextIndex - i):
+                        del cells[i]
+                    if (i > 0 and cells[i - 1].kind == WHITESPACE and
+                        (i == len(cells) or cells[i].kind == WHITESPACE)):
+                        del cells[i - 1]
+
+                    register = self.numRegisters
+                    self.numRegisters += 1
+                    self.instructions.append((APPLY, operator, operand1, operand2, register))
+                    result = SCSSProgramCell(VALUE, register = register)
+                    i = self.indexOf(previousCell)
+                    cells[i] = result
+                    i += 1
+
+                    if i < len(cells) - 1:
+                        cell = cells[i]
+                        priority = cell.priority
+
+            i += 1
+
+        if parentPriority:
+            if len(returnCells) == 0:
+                returnCells = cells[startIndex:i]
+
+            for i in range(0, len(returnCells)):
+                del cells[startIndex]
+            while len(returnCells) > 0 and returnCells[-1].kind == WHITESPACE:
+                returnCells = returnCells[0:-1]
+
+            if len(returnCells) != 1:
+                raise SCSSUnsupportedExpression() # an error, left for SCSSExpression to report
+
+            return self.operand(returnCells[0])
+
+    # evaluates the expression, given the same tokens it was compiled from (or
+    # clones of them), returns the resulting tokens
+    def run(self, tokens, scope):
+        registers = [None] * self.numRegisters
+        for instruction in self.instructions:
+            if instruction[0] == EVALUATE:
+                (opcode, kind, index, register, program) = instruction
+                token = tokens[index]
+                if kind == VARIABLE:
+                    value = token.variable
+                    if value is None:
+                        value = scope.get(token.getName(), token.parent)
+                    registers[register] = value.toToken()
+                elif kind == SET:
+                    registers[register] = self.evaluateSet(token, program, scope).toToken()
+                else:
+                    registers[register] = SCSSExpression.evaluateFunction(token, scope)
+            else:
+                (opcode, operator, operand1, operand2, register) = instruction
+                operand1 = self.resolve(operand1, tokens, registers, scope)
+                operand2 = self.resolve(operand2, tokens, registers, scope)
+                registers[register] = operand1.apply(operator, operand2).toToken()
+
+        result = []
+        for (index, register) in self.output:
+            result.append(tokens[index] if register == None else registers[register])
+        return result
+
+    def resolve(self, operand, tokens, registers, scope):
+        (kind, position) = operand
+        if kind == TOKEN:
+            return scssvariables.SCSSVariable.fromToken(tokens[position], scope)
+        elif kind == REGISTER:
+            return scssvariables.SCSSVariable.fromToken(registers[position], scope)
+        elif kind == ZERO:
+            return scssvariables.SCSSNumber(0)
+        else:
+            return None
+
+    def evaluateSet(self, token, program, scope):
+        tokens = program.run(token.getStrippedChildren(), scope)
+        if len(tokens) == 0:
+            raise SCSSCompileError("Cannot evaluate an empty set", token)
+        elif len(tokens) == 1:
+            return scssvariables.SCSSVariable.fromToken(tokens[0], scope)
+        else:
+            return scssvariables.SCSSList.fromTokens(tokens, scope)
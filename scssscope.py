@@ -1,71 +1,185 @@
-import copy
-
 from scssexceptions import *
 
 
+# a table of bindings that can be shared between scopes without copying, the
+# bindings are kept in layers of which only the top one is ever written to,
+# while all others are shared and left untouched
+class SCSSBindings(object):
+    # merging keeps adding layers, once there are more than this many they're
+    # flattened into one to keep lookups fast
+    MAX_LAYERS = 8
+
+    def __init__(self, layers = None):
+        self.top = {}
+        self.layers = layers if layers != None else [] # newest first
+
+    def __contains__(self, name):
+        if name in self.top:
+            return True
+        for layer in self.layers:
+            if name in layer:
+                return True
+        return False
+
+    def __getitem__(self, name):
+        if name in self.top:
+            return self.top[name]
+        for layer in self.layers:
+            if name in layer:
+                return layer[name]
+        raise KeyError(name)
+
+    def get(self, name, default = None):
+        if name in self.top:
+            return self.top[name]
+        for layer in self.layers:
+            if name in layer:
+                return layer[name]
+        return default
+
+    def __setitem__(self, name, value):
+        self.top[name] = value
+
+    def __iter__(self):
+        names = set(self.top)
+        for layer in self.layers:
+            names.update(layer)
+        return iter(names)
+
+    # turns the top layer into a shared one, after which the bindings can be
+    # shared with other tables
+    def freeze(self):
+        if self.top:
+            self.layers = [self.top] + self.layers
+            self.top = {}
+
+    def clone(self):
+        self.freeze()
+        return SCSSBindings(self.layers)
+
+    # adds all bindings from the given table, overriding existing ones
+    def merge(self, bindings):
+        self.freeze()
+        bindings.freeze()
+        layers = [layer for layer in self.layers if not SCSSBindings.containsLayer(bindings.layers, layer)]
+        self.layers = bindings.layers + layers
+        if len(self.layers) > SCSSBindings.MAX_LAYERS:
+            flattened = {}
+            for layer in reversed(self.layers):
+                flattened.update(layer)
+            self.layers = [flattened]
+
+    @staticmethod
+    def containsLayer(layers, layer):
+        for other in layers:
+            if other is layer:
+                return True
+        return False
+
+
+# marks names that are not bound in the cache of resolved names
+MISSING = object()
+
 class SCSSScope(object):
+    # every scope caches the names it has resolved, the cached results are
+    # valid as long as the epoch and the generation of the name are unchanged,
+    # binding a name bumps its generation, merging scopes bumps the epoch
+    epoch = 0
+    generations = {}
+
     def __init__(self, parent = None):
         self.parent = parent
-        self.variables = {}
-        self.mixins = {}
-        self.functions = {}
+        self.variables = SCSSBindings()
+        self.mixins = SCSSBindings()
+        self.functions = SCSSBindings()
+        self.resolved = {}
 
     def set(self, name, value):
         self.variables[name] = value
+        self.invalidate("variables", name)
 
     def has(self, name):
-        return name in self.variables or (self.parent and self.parent.has(name))
+        return self.resolve("variables", name) is not MISSING
 
     def get(self, name, token = None):
-        if name in self.variables:
-            return self.variables[name]
-        if self.parent:
-            return self.parent.get(name, token)
-        raise SCSSRunTimeError("No variable named $%s found" % name, token)
+        value = self.resolve("variables", name)
+        if value is MISSING:
+            raise SCSSRunTimeError("No variable named $%s found" % name, token)
+        return value
 
     def setMixin(self, name, value):
         self.mixins[name] = value
+        self.invalidate("mixins", name)
 
     def hasMixin(self, name):
-        return name in self.mixins or (self.parent and self.parent.hasMixin(name))
+        return self.resolve("mixins", name) is not MISSING
 
     def getMixin(self, name, token = None):
-        if name in self.mixins:
-            return self.mixins[name]
-        if self.parent:
-            return self.parent.getMixin(name, token)
-        raise SCSSRunTimeError("No mixin named %s found" % name, token)
+        value = self.resolve("mixins", name)
+        if value is MISSING:
+            raise SCSSRunTimeError("No mixin named %s found" % name, token)
+        return value
 
     def setFunction(self, name, value):
         self.functions[name] = value
+        self.invalidate("functions", name)
 
     def hasFunction(self, name):
-        return name in self.functions or (self.parent and self.parent.hasFunction(name))
+        return self.resolve("functions", name) is not MISSING
 
     def getFunction(self, name, token = None):
-        if name in self.functions:
-            return self.functions[name]
-        if self.parent:
-            return self.parent.getFunction(name, token)
-        raise SCSSRunTimeError("No function named %s found" % name, token)
+        value = self.resolve("functions", name)
+        if value is MISSING:
+            raise SCSSRunTimeError("No function named %s found" % name, token)
+        return value
+
+    # returns the value bound to the name in the given table of this scope or
+    # the closest parent scope that has it, or MISSING if there's none
+    def resolve(self, table, name):
+        value = getattr(self, table).get(name, MISSING)
+        if value is not MISSING or self.parent is None:
+            return value
+
+        key = (table, name)
+        epoch = SCSSScope.epoch
+        generation = SCSSScope.generations.get(key, 0)
+        entry = self.resolved.get(key)
+        if entry is not None and entry[0] == epoch and entry[1] == generation:
+            return entry[2]
+
+        scopes = [self]
+        scope = self.parent
+        while scope:
+            value = getattr(scope, table).get(name, MISSING)
+            if value is not MISSING:
+                break
+            scopes.append(scope)
+            scope = scope.parent
+
+        # the scopes we passed along the way resolve the name the same
+        entry = (epoch, generation, value)
+        for scope in scopes:
+            scope.resolved[key] = entry
+        return value
 
+    def invalidate(self, table, name):
+        key = (table, name)
+        SCSSScope.generations[key] = SCSSScope.generations.get(key, 0) + 1
+
+    # cloning and merging share the bindings rather than copying them, a
+    # binding is only copied when it's written to
     def clone(self):
         scope = SCSSScope(self.parent)
-        for name in self.variables:
-            scope.variables[name] = copy.copy(self.variables[name])
-        for name in self.mixins:
-            scope.mixins[name] = copy.copy(self.mixins[name])
-        for name in self.functions:
-            scope.functions[name] = copy.copy(self.functions[name])
+        scope.variables = self.variables.clone()
+        scope.mixins = self.mixins.clone()
+        scope.functions = self.functions.clone()
         return scope
 
     def merge(self, scope):
-        for name in scope.variables:
-            self.variables[name] = copy.copy(scope.variables[name])
-        for name in scope.mixins:
-            self.mixins[name] = copy.copy(scope.mixins[name])
-        for name in scope.functions:
-            self.functions[name] = copy.copy(scope.functions[name])
+        self.variables.merge(scope.variables)
+        self.mixins.merge(scope.mixins)
+        self.functions.merge(scope.functions)
+        SCSSScope.epoch += 1
 
     def toString(self):
         strings = []
@@ -75,3 +189,19 @@ class SCSSScope(object):
             else:
                 strings.append("WARNING: $%s has None value" % name)
         return "\n".join(strings)
+
+
+# the scope of a single iteration of a @for or @each loop, it only binds the
+# loop variable, all other variables are assigned in the enclosing scope, just
+# like they are in the body of an @if directive
+class SCSSLoopScope(SCSSScope):
+    def __init__(self, parent, name, value):
+        SCSSScope.__init__(self, parent)
+        self.name = name
+        SCSSScope.set(self, name, value)
+
+    def set(self, name, value):
+        if name == self.name:
+            SCSSScope.set(self, name, value)
+        else:
+            self.parent.set(name, value)
@@ -45,6 +45,12 @@ COLOR_MAP = {
     "wheat": [245, 222, 179]
 }
 
+# the functions that produce colors
+COLOR_FUNCTIONS = set(["rgb", "rgba", "hsl", "hsla"])
+
+# the colors parsed from keywords and hashes so far, by the keyword or hash
+COLOR_LITERALS = {}
+
 CONVERSIONS = {
     "cm": { "cm": 1,     "in": 0.39,  "mm": 10,    "pc":  0.033,  "pt":  0.0055  },
     "in": { "cm": 2.54,  "in": 1,     "mm": 25.4,  "pc": 12,      "pt": 72       },
@@ -69,6 +75,11 @@ class SCSSVariable(object):
     def toString(self):
         return ""
 
+    # returns a hashable representation of the value, which is equal for equal
+    # values, or None if the variable cannot be represented this way
+    def cacheKey(self):
+        return None
+
     def toToken(self, parent = None):
         return cssparser.SCSSVariableToken(parent, self)
 
@@ -137,11 +148,12 @@ class SCSSVariable(object):
             return SCSSBoolean(token)
         elif token.isString():
             return SCSSString(token)
-        elif token.isIdentifier() or token.isHash() or token.isFunction():
-            try: # just try and see whether it's a color
-                return SCSSColor(token)
-            except SCSSRunTimeError, error:
-                pass
+        elif token.isIdentifier() or token.isHash():
+            color = SCSSColor.fromLiteral(token.data)
+            if color is not None:
+                return color
+        elif token.isFunction() and token.getName() in COLOR_FUNCTIONS:
+            return SCSSColor(token)
         return SCSSToken(token, scope)
 
 
@@ -192,6 +204,9 @@ class SCSSNumber(SCSSVariable):
 
         raise SCSSRunTimeError("Unrecognized value \"%s\" assigned to number" % value)
 
+    def cacheKey(self):
+        return ("number", repr(self.value), self.unit)
+
     def toString(self, options = cssparser.CSSOptions()):
         return str(self.value) + self.unit
 
@@ -312,19 +327,22 @@ class SCSSString(SCSSVariable):
 
         raise SCSSRunTimeError("Unrecognized value \"%s\" (%s) assigned to string" % (value, value.__class__))
 
+    def cacheKey(self):
+        return ("string", self.value)
+
     def toString(self, options = cssparser.CSSOptions()):
-        result = ""
-        stream = cssparser.CSSStream(self.value)
+        result = []
+        stream = cssparser.createStream(self.value)
         character = stream.take()
         while character != cssparser.CSS_EOF:
             if character == "\"":
-                result += "\\"
-            result += character
+                result.append("\\")
+            result.append(character)
             character = stream.take()
         if options.stripQuotes:
-            return result
+            return "".join(result)
         else:
-            return "\"" + result + "\""
+            return "\"" + "".join(result) + "\""
 
     def __add__(self, operand):
         if isinstance(operand, SCSSList):
@@ -362,6 +380,22 @@ class SCSSColor(SCSSVariable):
         else:
             self.setRgbValue(0.0, 0.0, 0.0)
 
+    # returns the color for a keyword or hash, or None if it doesn't represent
+    # a color
+    @staticmethod
+    def fromLiteral(literal):
+        if not (literal in COLOR_MAP or (literal[0:1] == "#" and len(literal) in [4, 7])):
+            return None
+
+        color = COLOR_LITERALS.get(literal)
+        if color is None:
+            color = SCSSColor(literal)
+            COLOR_LITERALS[literal] = color
+
+        copy = SCSSColor() # colors are not immutable, so every token gets its own
+        copy.setValue(color)
+        return copy
+
     def setValue(self, value):
         if isinstance(value, list):
             self.setRgbValue(value[0], value[1], value[2])
@@ -440,6 +474,9 @@ class SCSSColor(SCSSVariable):
 
         raise SCSSRunTimeError("Unrecognized value \"%s\" (%s) assigned to color" % (str(value), value))
 
+    def cacheKey(self):
+        return ("color", self.r, self.g, self.b, self.h, self.s, self.l, self.a)
+
     def toString(self, options = cssparser.CSSOptions()):
         if self.a == 0.0:
             return "transparent"
@@ -670,6 +707,9 @@ class SCSSBoolean(SCSSVariable):
 
         raise SCSSRunTimeError("Unrecognized value \"%s\" (%s) assigned to boolean" % (value.toString(), value))
 
+    def cacheKey(self):
+        return ("boolean", self.value)
+
     def toString(self, options = cssparser.CSSOptions()):
         return "true" if self.value else "false"
 
@@ -786,6 +826,17 @@ class SCSSList(SCSSVariable):
             howMany -= 1
         self.items[index] = value
 
+    def cacheKey(self):
+        keys = []
+        for item in self.items:
+            if item is None:
+                return None
+            key = item.cacheKey()
+            if key is None:
+                return None
+            keys.append(key)
+        return ("list", self.separator, tuple(keys))
+
     def toString(self, options = cssparser.CSSOptions()):
         strings = []
         for item in self.items:
@@ -838,6 +889,11 @@ class SCSSToken(SCSSVariable):
 
         self.token = token
 
+    def cacheKey(self):
+        if self.token and self.token.isIdentifier():
+            return ("identifier", self.token.data)
+        return None
+
     def toString(self, options = cssparser.CSSOptions()):
         return self.token.toString(options)
 
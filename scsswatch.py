@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+
+import scssbatch
+import scsscache
+import scssimporter
+
+
+# files modified less than this many seconds before compiling started may have
+# been modified after they were read, as not every file system records mtimes
+# more precisely
+MTIME_RESOLUTION = 2.0
+
+
+class SCSSWatcher(object):
+    def __init__(self, directory, outputDirectory, options):
+        self.directory = directory
+        self.outputDirectory = outputDirectory
+        self.options = options
+        self.dependencies = {}
+        self.mtimes = {}
+
+        if not scssimporter.Importer.parseCache:
+            scssimporter.Importer.setParseCache(scsscache.SCSSParseCache())
+
+    # compiles all entries and then keeps recompiling those affected by a
+    # change until interrupted
+    def watch(self, interval = 1.0, log = sys.stderr):
+        self.poll(log)
+        log.write("Watching %s for changes...\n" % self.directory)
+        try:
+            while True:
+                time.sleep(interval)
+                self.poll(log)
+        except KeyboardInterrupt:
+            pass
+
+    # recompiles every entry that is new or depends on a file that changed
+    # since the last poll, returns the list of recompiled entries
+    def poll(self, log = sys.stderr):
+        batchCompiler = scssbatch.SCSSBatchCompiler()
+        batchCompiler.addDirectory(self.directory, self.outputDirectory)
+
+        entries = dict(batchCompiler.entries)
+        for inputPath in self.dependencies.keys():
+            if inputPath not in entries:
+                del self.dependencies[inputPath]
+
+        changedPaths = set()
+        for path in self.watchedPaths():
+            mtime = self.mtime(path)
+            if mtime != self.mtimes.get(path):
+                changedPaths.add(path)
+                self.mtimes[path] = mtime
+
+        recompiled = []
+        for (inputPath, outputPath) in batchCompiler.entries:
+            if inputPath not in self.dependencies or self.dependencies[inputPath] & changedPaths:
+                self.compileEntry(inputPath, outputPath, log)
+                recompiled.append(inputPath)
+        return recompiled
+
+    def compileEntry(self, inputPath, outputPath, log):
+        inputMtime = self.mtime(os.path.abspath(inputPath))
+        start = time.time()
+        try:
+            scssbatch.compileFile(inputPath, outputPath, self.options)
+            log.write("%9.1f ms  %s -> %s\n" % ((time.time() - start) * 1000, inputPath, outputPath))
+        except Exception, exception:
+            log.write("%9s     %s: %s\n" % ("FAILED", inputPath, exception))
+
+        # the imports are recorded even if compiling failed, so that fixing
+        # an imported file triggers the entry to be recompiled
+        dependencies = set([os.path.abspath(path) for path in scssimporter.Importer.imports.keys()])
+        dependencies.add(os.path.abspath(inputPath))
+        self.dependencies[inputPath] = dependencies
+
+        # the mtimes of newly found imports can only be recorded now, but they
+        # may have been modified since they were read. those are left out, so
+        # the entry is recompiled on the next poll
+        if os.path.abspath(inputPath) not in self.mtimes:
+            self.mtimes[os.path.abspath(inputPath)] = inputMtime
+        for path in dependencies:
+            if path not in self.mtimes:
+                mtime = self.mtime(path)
+                if mtime and mtime[0] < start - MTIME_RESOLUTION:
+                    self.mtimes[path] = mtime
+
+    def watchedPaths(self):
+        paths = set()
+        for dependencies in self.dependencies.values():
+            paths.update(dependencies)
+        return paths
+
+    def mtime(self, path):
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
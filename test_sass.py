@@ -3,11 +3,19 @@
 from __future__ import with_statement
 
 import codecs
+import StringIO
 import optparse
 import os
+import re
+import shutil
+import tempfile
+import time
 
+import cssoptimizer
 import cssparser
+import scssbatch
 import scsscompiler
+import scsswatch
 
 
 def dirEntries(path):
@@ -18,38 +26,137 @@ def dirEntries(path):
             continue
         yield entry
 
+def runTest(path, test, o, optimizeLevel = 0):
+    parser = cssparser.CSSParser()
+    options = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True,
+                                   fastTokenizer = not o.slow_tokenizer)
+    colorOptions = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True, colorize = True)
+
+    with codecs.open(path + "/in.scss", "r", "utf-8") as f:
+        token = parser.parse(f.read(), options)
+
+    compiler = scsscompiler.SCSSCompiler()
+    compiler.compile(token)
+    if optimizeLevel:
+        optimizer = cssoptimizer.CSSOptimizer(optimizeLevel)
+        optimizer.optimize(token)
+    output = token.toString(options)
+
+    with codecs.open(path + "/out.css", "r", "utf-8") as f:
+        expected = f.read()
+
+    if output == expected.strip():
+        print "Test %s passed." % test
+    else:
+        if o.color:
+            expectedToken = parser.parse(expected)
+            expected = expectedToken.toString(colorOptions)
+            output = token.toString(colorOptions)
+
+        print "Test %s FAILED!" % test
+        print "EXPECTED:" + expected
+        print "RECEIVED:" + output
+        print ""
+
+# compiles the input of a test with whitespace and comments skipped while
+# parsing, and checks that the output is the same as when they're parsed and
+# stripped later on, except for runs of whitespace around the comments
+def runSkippingTest(path, test, o):
+    parser = cssparser.CSSParser()
+    options = cssparser.CSSOptions(stripWhiteSpace = True, stripComments = True, compileScss = True,
+                                   fastTokenizer = not o.slow_tokenizer)
+    keepingOptions = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True,
+                                          fastTokenizer = not o.slow_tokenizer)
+
+    with codecs.open(path + "/in.scss", "r", "utf-8") as f:
+        input = f.read()
+
+    outputs = []
+    for parseOptions in [keepingOptions, options]:
+        token = parser.parse(input, parseOptions)
+        compiler = scsscompiler.SCSSCompiler()
+        compiler.compile(token)
+        outputs.append(re.sub(r"\s+", " ", token.toString(options)))
+
+    if outputs[0] == outputs[1]:
+        print "Test %s passed." % test
+    else:
+        print "Test %s FAILED!" % test
+        print "EXPECTED:" + outputs[0]
+        print "RECEIVED:" + outputs[1]
+        print ""
+
+# checks that the watcher recompiles an entry when an imported partial changes,
+# also when the change happens while the entry is compiled for the first time
+def runWatchTest(test, o):
+    directory = tempfile.mkdtemp()
+    compileFile = scssbatch.compileFile
+    try:
+        def writeFile(name, content, age = 0):
+            path = os.path.join(directory, name)
+            with open(path, "w") as f:
+                f.write(content)
+            os.utime(path, (time.time() - age, time.time() - age))
+
+        def readOutput():
+            with open(os.path.join(directory, "main.css"), "r") as f:
+                return f.read()
+
+        writeFile("main.scss", "@import \"partial\";\n.a { width: $width; }\n", age = 10)
+        writeFile("_partial.scss", "$width: 1px;\n", age = 10)
+
+        options = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True,
+                                       fastTokenizer = not o.slow_tokenizer)
+        watcher = scsswatch.SCSSWatcher(directory, None, options)
+        log = StringIO.StringIO()
+
+        # the partial is saved while the entry compiles for the first time
+        def compileAndEdit(inputPath, outputPath, options):
+            compileFile(inputPath, outputPath, options)
+            writeFile("_partial.scss", "$width: 2px;\n")
+        scssbatch.compileFile = compileAndEdit
+        results = [watcher.poll(log), readOutput()]
+        scssbatch.compileFile = compileFile
+
+        results += [watcher.poll(log), readOutput()]
+        writeFile("_partial.scss", "$width: 3px;\n", age = -10)
+        results += [watcher.poll(log), readOutput(), watcher.poll(log)]
+
+        main = os.path.join(directory, "main.scss")
+        expected = [[main], ".a{width:1px;}\n", [main], ".a{width:2px;}\n",
+                    [main], ".a{width:3px;}\n", []]
+    finally:
+        scssbatch.compileFile = compileFile
+        shutil.rmtree(directory)
+
+    if results == expected:
+        print "Test %s passed." % test
+    else:
+        print "Test %s FAILED!" % test
+        print "EXPECTED:" + repr(expected)
+        print "RECEIVED:" + repr(results)
+        print ""
+
 if __name__ == "__main__":
 
     usage = "Usage: %prog [options]"
     optionParser = optparse.OptionParser(usage = usage)
     optionParser.add_option("", "--color", action = "store_true",
                       help = "Colorize the output")
+    optionParser.add_option("", "--slow-tokenizer", action = "store_true",
+                      help = "Parse using the character-by-character tokenizer")
     (o, args) = optionParser.parse_args()
 
     for test in dirEntries("test/sass"):
-        parser = cssparser.CSSParser()
-        options = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True)
-        colorOptions = cssparser.CSSOptions(stripWhiteSpace = True, compileScss = True, colorize = True)
+        runTest("test/sass/" + test, test, o)
 
-        with codecs.open("test/sass/%s/in.scss" % test, "r", "utf-8") as f:
-            token = parser.parse(f.read(), options)
-    
-        compiler = scsscompiler.SCSSCompiler()
-        compiler.compile(token)
-        output = token.toString(options)
-
-        with codecs.open("test/sass/%s/out.css" % test, "r", "utf-8") as f:
-            expected = f.read()
-
-        if output == expected.strip():
-            print "Test %s passed." % test
-        else:
-            if o.color:
-                expectedToken = parser.parse(expected)
-                expected = expectedToken.toString(colorOptions)
-                output = token.toString(colorOptions)
-
-            print "Test %s FAILED!" % test
-            print "EXPECTED:" + expected
-            print "RECEIVED:" + output
-            print ""
+    # the same tests, skipping whitespace and comments while parsing
+    for test in dirEntries("test/sass"):
+        runSkippingTest("test/sass/" + test, "skipping/" + test, o)
+
+    # the tests of the optimizer are grouped by the level they are run with
+    for level in dirEntries("test/optimize"):
+        for test in dirEntries("test/optimize/" + level):
+            runTest("test/optimize/%s/%s" % (level, test), "optimize/%s/%s" % (level, test), o, int(level))
+
+    runWatchTest("watch", o)